@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# bench/microbench.py — microbenchmarks for the storage, license and whitelist helpers
+#
+# Times load_data, save_data, load_licenses, the in-memory is_whitelisted and
+# license_valid_for_guild lookups, key_is_valid_and_avail, add_whitelist_guild
+# and shell_block from main.py on synthetic datasets, and writes the results as JSON. Pass --compare with an
+# earlier result file to flag regressions (exit code 1).
+#
+#   python bench/microbench.py --out bench-before.json
+#   python bench/microbench.py --out bench-after.json --compare bench-before.json
+#   python bench/microbench.py --quick --store sqlite
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timezone, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+KEY_SIZES = (10, 1_000, 10_000, 100_000)
+WHITELIST_SIZES = (10, 1_000, 10_000, 50_000)
+QUICK_KEY_SIZES = (10, 1_000)
+QUICK_WHITELIST_SIZES = (10, 1_000)
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Microbenchmarks for main.py storage/license/whitelist helpers.")
+    p.add_argument("--store", choices=("json", "sqlite"), default="json", help="state store backend to benchmark")
+    p.add_argument("--quick", action="store_true", help="small datasets only")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--min-time", type=float, default=0.05, help="minimum seconds per repeat")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", default="microbench.json")
+    p.add_argument("--compare", help="earlier result file to compare against")
+    p.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a case counts as a regression")
+    return p.parse_args(argv)
+
+
+args = parse_args()
+
+# main.py picks its store and data dir at import time
+os.environ.setdefault("BOT_TOKEN", "microbench")
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="microbench-")
+os.environ["STATE_STORE"] = args.store
+os.environ["METRICS_PORT"] = "0"
+
+import main  # noqa: E402
+
+
+# ---------------- Synthetic datasets ----------------
+def make_licenses(n_keys: int, rng: random.Random):
+    now = datetime.now(timezone.utc)
+    keys = {}
+    for i in range(n_keys):
+        bound = i % 2 == 0
+        keys[f"{i:032x}"] = {
+            "duration": "30d",
+            "issued_at": now.isoformat(),
+            "expires_at": (now + timedelta(days=rng.randint(1, 30))).isoformat(),
+            "used": bound,
+            "user_id": 10_000 + i if bound else None,
+            "guild_id": 1_000_000 + i if bound else None,
+        }
+    return {"keys": keys}
+
+
+def make_security(n_ids: int, rng: random.Random, guild_id=42):
+    d = json.loads(json.dumps(main.DEFAULT_DATA))
+    d["whitelists"] = {str(guild_id): sorted(rng.sample(range(10**17, 10**17 + n_ids * 10), n_ids))}
+    return d
+
+
+# ---------------- Timing ----------------
+def measure(fn, repeat: int, min_time: float):
+    # calibrate the number of calls per repeat, then take `repeat` samples
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return {
+        "calls_per_repeat": number,
+        "min_us": round(min(samples) * 1e6, 3),
+        "median_us": round(statistics.median(samples) * 1e6, 3),
+        "mean_us": round(statistics.fmean(samples) * 1e6, 3),
+    }
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    key_sizes = QUICK_KEY_SIZES if args.quick else KEY_SIZES
+    wl_sizes = QUICK_WHITELIST_SIZES if args.quick else WHITELIST_SIZES
+    results = []
+
+    def case(name, size, fn):
+        r = measure(fn, args.repeat, args.min_time)
+        r.update({"case": name, "size": size})
+        results.append(r)
+        print(f"{name:<28} n={size:<7} median {r['median_us']:>12.2f} us  min {r['min_us']:>12.2f} us")
+
+    for n in wl_sizes:
+        sec = make_security(n, rng)
+        main.save_data(sec)
+        main.apply_data_update(sec)
+        ids = sec["whitelists"]["42"]
+        present, absent = ids[len(ids) // 2], 1
+        case("load_data", n, main.load_data)
+        case("save_data", n, lambda: main.save_data(sec))
+        case("is_whitelisted.hit", n, lambda: main.is_whitelisted(42, present))
+        case("is_whitelisted.miss", n, lambda: main.is_whitelisted(42, absent))
+        counter = iter(range(10**18, 10**19))
+        case("add_whitelist_guild", n, lambda: main.add_whitelist_guild(42, next(counter)))
+
+    for n in key_sizes:
+        lic = make_licenses(n, rng)
+        main.save_licenses(lic)
+        main.apply_licenses_update(lic)
+        case("load_licenses", n, main.load_licenses)
+        keys = list(lic["keys"])
+        last_guild = lic["keys"][keys[-2 if n > 1 else 0]]["guild_id"] or 0
+        free_key = keys[-1] if n > 1 else keys[0]
+        case("license_valid_for_guild.hit", n, lambda: main.license_valid_for_guild(last_guild))
+        case("license_valid_for_guild.miss", n, lambda: main.license_valid_for_guild(1))
+        case("key_is_valid_and_avail", n, lambda: main.key_is_valid_and_avail(free_key))
+        case("key_is_valid_and_avail.miss", n, lambda: main.key_is_valid_and_avail("nope"))
+
+    for n in (1, 10, 100, 1_000):
+        lines = [f"line {i}: " + "x" * 40 for i in range(n)]
+        case("shell_block", n, lambda: main.shell_block(lines))
+
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "store": args.store,
+        "quick": args.quick,
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float):
+    base = {(r["case"], r["size"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for r in current["results"]:
+        old = base.get((r["case"], r["size"]))
+        if not old or not old["median_us"]:
+            continue
+        ratio = r["median_us"] / old["median_us"]
+        if ratio > 1 + tolerance:
+            regressions.append((r["case"], r["size"], old["median_us"], r["median_us"], ratio))
+    return regressions
+
+
+def main_cli():
+    report = run(args)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.out}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("store") != report["store"]:
+            print(f"note: baseline used the {baseline.get('store')} store, this run used {report['store']}")
+        regressions = compare(report, baseline, args.tolerance)
+        for name, size, old, new, ratio in regressions:
+            print(f"REGRESSION {name} n={size}: {old:.2f} us -> {new:.2f} us ({ratio:.2f}x)")
+        if regressions:
+            raise SystemExit(1)
+        print(f"no regressions beyond {args.tolerance:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main_cli()
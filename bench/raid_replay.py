@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# bench/raid_replay.py — offline raid replay against the real handlers in main.py
+#
+# Drives on_guild_channel_delete / on_message / fast_punish ... with fake
+# guild/member/channel objects whose REST methods go through MockRest
+# (configurable latency and 429s). Nothing touches the network.
+#
+#   python bench/raid_replay.py --channel-deletes 50 --spam 200 --duration 10
+#   python bench/raid_replay.py --latency 0.08 --rate-limit-every 25 --json out.json
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# isolate main.py from the real data dir, token and metrics port before import
+os.environ.setdefault("BOT_TOKEN", "offline-replay")
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="raid-replay-")
+os.environ["STATE_STORE"] = "memory"
+os.environ["METRICS_PORT"] = "0"
+
+import discord  # noqa: E402
+import main  # noqa: E402
+
+
+# ---------------- Mock REST layer ----------------
+class MockRest:
+    """Counts calls per route, adds latency and injects 429s (then retries like discord.py)."""
+
+    def __init__(self, latency=0.05, jitter=0.02, rate_limit_every=0, retry_after=1.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.calls = defaultdict(int)
+        self.rate_limited = defaultdict(int)
+        self.total = 0
+
+    async def call(self, route: str):
+        while True:
+            self.total += 1
+            self.calls[route] += 1
+            await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+            if self.rate_limit_every and self.total % self.rate_limit_every == 0:
+                self.rate_limited[route] += 1
+                await asyncio.sleep(self.retry_after)
+                continue
+            return
+
+
+# ---------------- Fakes ----------------
+class FakePerms:
+    kick_members = True
+    moderate_members = True
+    ban_members = True
+
+
+class FakeMember(discord.Member):
+    # discord.Member is only subclassed so isinstance() checks in main.py pass;
+    # none of its state is initialised.
+    def __init__(self, sim, guild, uid, rank=1, bot=False):
+        self._sim = sim
+        self._guild = guild
+        self._uid = uid
+        self._rank = rank
+        self._bot = bot
+
+    id = property(lambda self: self._uid)
+    bot = property(lambda self: self._bot)
+    top_role = property(lambda self: self._rank)
+    roles = property(lambda self: [])
+    mention = property(lambda self: f"<@{self._uid}>")
+    guild_permissions = property(lambda self: FakePerms())
+
+    def __hash__(self):
+        return hash(self._uid)
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self._uid
+
+    def __repr__(self):
+        return f"<FakeMember {self._uid}>"
+
+    async def kick(self, *, reason=None):
+        await self._sim.rest.call("DELETE /guilds/{id}/members/{id}")
+        self._guild.members.pop(self._uid, None)
+        self._sim.record_punishment("kick", self._uid)
+
+    async def timeout(self, until, /, *, reason=None):
+        await self._sim.rest.call("PATCH /guilds/{id}/members/{id}")
+        self._sim.record_punishment("timeout", self._uid)
+
+    async def add_roles(self, *roles, reason=None, atomic=True):
+        await self._sim.rest.call("PUT /guilds/{id}/members/{id}/roles/{id}")
+
+
+class FakeChannel:
+    def __init__(self, sim, guild, cid, name):
+        self._sim = sim
+        self.guild = guild
+        self.id = cid
+        self.name = name
+        self.mention = f"<#{cid}>"
+
+    async def send(self, content=None, **kwargs):
+        await self._sim.rest.call("POST /channels/{id}/messages")
+
+    async def delete(self, *, reason=None):
+        await self._sim.rest.call("DELETE /channels/{id}")
+        self.guild.channels.pop(self.id, None)
+
+    async def delete_messages(self, messages, *, reason=None):
+        await self._sim.rest.call("POST /channels/{id}/messages/bulk-delete")
+
+    async def purge(self, *, limit=100, check=None, **kwargs):
+        await self._sim.rest.call("POST /channels/{id}/messages/bulk-delete")
+        return []
+
+    async def webhooks(self):
+        await self._sim.rest.call("GET /channels/{id}/webhooks")
+        return []
+
+
+class FakeRole:
+    def __init__(self, rid, name):
+        self.id = rid
+        self.name = name
+
+
+class FakeAuditEntry:
+    def __init__(self, eid, action, user, target=None):
+        self.id = eid
+        self.action = action
+        self.user = user
+        self.target = target
+
+
+class FakeGuild:
+    def __init__(self, sim, gid):
+        self._sim = sim
+        self.id = gid
+        self.shard_id = 0
+        self.owner_id = 1
+        self.members = {}
+        self.channels = {}
+        self.roles_by_id = {}
+        self.audit = []
+        self.me = FakeMember(sim, self, 999, rank=100, bot=True)
+
+    # cache accessors used by main.py
+    @property
+    def text_channels(self):
+        return list(self.channels.values())
+
+    @property
+    def roles(self):
+        return list(self.roles_by_id.values())
+
+    def get_member(self, uid):
+        return self.members.get(uid)
+
+    def get_channel(self, cid):
+        return self.channels.get(cid)
+
+    def get_role(self, rid):
+        return self.roles_by_id.get(rid)
+
+    async def fetch_member(self, uid):
+        await self._sim.rest.call("GET /guilds/{id}/members/{id}")
+        m = self.members.get(uid)
+        if m is None:
+            raise LookupError("Unknown Member")
+        return m
+
+    async def ban(self, user, *, reason=None, delete_message_seconds=0):
+        await self._sim.rest.call("PUT /guilds/{id}/bans/{id}")
+        self.members.pop(user.id, None)
+        self._sim.record_punishment("ban", user.id)
+
+    async def create_text_channel(self, name, **kwargs):
+        await self._sim.rest.call("POST /guilds/{id}/channels")
+        return self.add_channel(name)
+
+    async def create_role(self, *, name, **kwargs):
+        await self._sim.rest.call("POST /guilds/{id}/roles")
+        r = FakeRole(self._sim.next_id(), name)
+        self.roles_by_id[r.id] = r
+        return r
+
+    async def audit_logs(self, *, limit=100, action=None, **kwargs):
+        await self._sim.rest.call("GET /guilds/{id}/audit-logs")
+        n = 0
+        for e in reversed(self.audit):
+            if action is not None and e.action != action:
+                continue
+            yield e
+            n += 1
+            if n >= limit:
+                return
+
+    # scripting helpers
+    def add_member(self, uid, rank=1, bot=False):
+        m = self.members[uid] = FakeMember(self._sim, self, uid, rank=rank, bot=bot)
+        return m
+
+    def add_channel(self, name):
+        ch = FakeChannel(self._sim, self, self._sim.next_id(), name)
+        self.channels[ch.id] = ch
+        return ch
+
+
+class FakeMessage:
+    def __init__(self, mid, guild, channel, author, content):
+        self.id = mid
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.content = content
+
+
+# ---------------- Simulator ----------------
+class RaidSim:
+    def __init__(self, rest: MockRest, seed=1):
+        random.seed(seed)
+        self.rest = rest
+        self._ids = 10_000
+        self.start = None
+        self.first_punishment = None
+        self.punishments = defaultdict(int)
+        self.punished_users = set()
+        self.by_user = defaultdict(list)
+        self.events = 0
+
+    def next_id(self):
+        self._ids += 1
+        return self._ids
+
+    def record_punishment(self, kind, uid):
+        if self.first_punishment is None:
+            self.first_punishment = time.perf_counter() - self.start
+        self.punishments[kind] += 1
+        self.punished_users.add(uid)
+        self.by_user[uid].append(kind)
+
+    def build_guild(self, gid=424242, channels=60):
+        g = FakeGuild(self, gid)
+        for i in range(channels):
+            g.add_channel(f"general-{i}")
+        # licence the guild in the in-memory store
+        main.apply_licenses_update(main.update_licenses(
+            lambda l: l.setdefault("keys", {}).update(replay={"guild_id": gid, "expires_at": "permanent", "used": True}))[1])
+        # duplicate-content detection is opt-in; the replay's spammers exercise it
+        main.apply_data_update(main.update_guild_settings(gid, {"spam_dup_authors": 5}))
+        return g
+
+
+async def first_offense_burst(sim, guild, messages=10, uid=900):
+    # a fresh member's burst is one incident: every punishment must stay at the
+    # floor action (the spam timeout), however many messages are in flight
+    author = guild.add_member(uid)
+    channel = guild.add_channel("burst")
+    await asyncio.gather(*(main.on_message(FakeMessage(sim.next_id(), guild, channel, author, f"burst {i}"))
+                           for i in range(messages)), return_exceptions=True)
+    kinds = sim.by_user.get(uid, [])
+    return {"messages": messages, "punishments": kinds, "ok": bool(kinds) and set(kinds) == {"timeout"}}
+
+
+async def run_scenario(args):
+    rest = MockRest(args.latency, args.jitter, args.rate_limit_every, args.retry_after)
+    sim = RaidSim(rest, seed=args.seed)
+    guild = sim.build_guild()
+    nukers = [guild.add_member(100 + i) for i in range(args.nukers)]
+    spammers = [guild.add_member(500 + i) for i in range(args.spammers)]
+    spam_channel = guild.add_channel("chat")
+
+    async def _no_commands(message):
+        return None
+    main.bot.process_commands = _no_commands
+
+    # script: (offset seconds, coroutine factory)
+    script = []
+    victims = [ch for ch in guild.text_channels if ch.name.startswith("general-")][:args.channel_deletes]
+    for i, ch in enumerate(victims):
+        actor = nukers[i % len(nukers)]
+
+        def delete(ch=ch, actor=actor):
+            guild.channels.pop(ch.id, None)
+            guild.audit.append(FakeAuditEntry(sim.next_id(), discord.AuditLogAction.channel_delete, actor, ch))
+            return main.on_guild_channel_delete(ch)
+        script.append((random.uniform(0, args.duration), delete))
+    for i in range(args.spam):
+        author = spammers[i % len(spammers)]
+
+        def spam(author=author, i=i):
+            return main.on_message(FakeMessage(sim.next_id(), guild, spam_channel, author, f"raid spam {i}"))
+        script.append((random.uniform(0, args.duration), spam))
+    script.sort(key=lambda x: x[0])
+
+    tasks = []
+    sim.start = time.perf_counter()
+    for offset, factory in script:
+        delay = offset / args.speed - (time.perf_counter() - sim.start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        sim.events += 1
+        tasks.append(asyncio.create_task(factory()))
+    dispatched = time.perf_counter() - sim.start
+    await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - sim.start
+    punishments, punished = dict(sim.punishments), len(sim.punished_users)
+    burst = await first_offense_burst(sim, guild)
+
+    return {
+        "scenario": {
+            "channel_deletes": len(victims),
+            "spam_messages": args.spam,
+            "duration_s": args.duration,
+            "speed": args.speed,
+            "nukers": args.nukers,
+            "spammers": args.spammers,
+            "rest_latency_s": args.latency,
+            "rate_limit_every": args.rate_limit_every,
+        },
+        "events": sim.events,
+        "dispatch_s": round(dispatched, 3),
+        "drain_s": round(elapsed, 3),
+        "events_per_sec": round(sim.events / elapsed, 2) if elapsed else 0.0,
+        "time_to_first_punishment_s": round(sim.first_punishment, 3) if sim.first_punishment is not None else None,
+        "punishments": punishments,
+        "attackers_punished": punished,
+        "attackers_total": args.nukers + args.spammers,
+        "rest_calls_total": rest.total,
+        "rest_429_total": sum(rest.rate_limited.values()),
+        "rest_calls_by_route": dict(sorted(rest.calls.items(), key=lambda kv: -kv[1])),
+        "first_offense_burst": burst,
+    }
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Replay a scripted raid against main.py handlers offline.")
+    p.add_argument("--channel-deletes", type=int, default=50)
+    p.add_argument("--spam", type=int, default=200, help="spam messages in total")
+    p.add_argument("--duration", type=float, default=10.0, help="raid length in seconds (script time)")
+    p.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier")
+    p.add_argument("--nukers", type=int, default=5)
+    p.add_argument("--spammers", type=int, default=20)
+    p.add_argument("--latency", type=float, default=0.05, help="mock REST latency in seconds")
+    p.add_argument("--jitter", type=float, default=0.02)
+    p.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth REST call with a 429 (0 = never)")
+    p.add_argument("--retry-after", type=float, default=1.0)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--json", help="also write the report to this file")
+    return p.parse_args(argv)
+
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run_scenario(args))
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if not report["first_offense_burst"]["ok"]:
+        sys.exit("first-offense burst escalated past the floor action")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -3,20 +3,41 @@
 # Python 3.11, discord.py 2.x compatible
 
 import os
+import sys
 import json
 import asyncio
+import functools
+import hashlib
+import io
+import math
+import cProfile
+import pstats
+import re
 import secrets
+import sqlite3
+import subprocess
+import threading
+import time
+import traceback
+import unicodedata
+import tracemalloc
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 import aiohttp
+from aiohttp import web
 from datetime import datetime, timezone, timedelta
 from collections import deque, defaultdict
-from dotenv import load_dotenv
+from dotenv import load_dotenv, find_dotenv, dotenv_values
 import discord
 from discord.ext import commands, tasks
 from discord import ui, ButtonStyle, PermissionOverwrite
 
 load_dotenv()
+TOKEN = os.getenv("BOT_TOKEN")
 GUILD_ID = os.getenv("GUILD_ID")
 BACKGROUND_IMG_URL = os.getenv("BACKGROUND_IMG_URL", "").strip()
+# single | sharded | cluster (see "Run mode / sharding" and "Cluster launcher")
+RUN_MODE = os.getenv("RUN_MODE", "single").strip().lower()
 if not TOKEN:
     raise SystemExit("BOT_TOKEN missing in .env")
 
@@ -25,9 +46,13 @@ MASTER_OWNER_ID = 1425374606662832189
 WEBHOOK_URL = "https://discord.com/api/webhooks/1436219906755657862/_vxgqH0BL79A9oJ5g6xLKOjRxm9x-7l4_pOqw6Bp503CQe4g5MXtZDoWaVm-1MB2OEGW"
 
 # ---------- data files ----------
-DATA_DIR = "data"
+DATA_DIR = os.getenv("DATA_DIR", "data")
 DATA_FILE = os.path.join(DATA_DIR, "security.json")
 LICENSE_FILE = os.path.join(DATA_DIR, "licenses.json")
+CURSOR_FILE = os.path.join(DATA_DIR, "cursors.json")
+BASELINE_FILE = os.path.join(DATA_DIR, "baselines.json")
+THREAT_FILE = os.path.join(DATA_DIR, "threats.json")
+OFFENSE_FILE = os.path.join(DATA_DIR, "offenses.json")
 
 DEFAULT_DATA = {
     "whitelists": {},  # per-guild: "guild_id": [user_id,...]
@@ -54,44 +79,524 @@ DEFAULT_DATA = {
     "spam_delete_threshold": 5,
     "spam_delete_window": 5,
     "spam_strike_timeout_threshold": 1,
+    # distinct accounts posting the same text within the window before all are
+    # timed out; 0 = off (default, opt in per guild via guild_settings)
+    "spam_dup_authors": 0,
+    "spam_dup_window": 30,
+    # link filter: blocked domains/phrases on top of LINK_DOMAINS_FILE / LINK_PHRASES_FILE
+    "anti_link": True,
+    # repeat offenders climb ESCALATION_LADDER (warn -> timeouts -> kick -> ban)
+    "escalation": True,
+    # with auto_kick and auto_timeout both off the ladder stays silent unless this is on
+    "escalation_standalone": False,
+    "block_invites": True,
+    "blocked_domains": [],
+    "blocked_phrases": [],
+    "guild_settings": {},  # per-guild overrides: "guild_id": {"auto_kick": False, ...}
     "panel_messages": {}  # "guild_id": message_id
 }
 
 DEFAULT_LICENSES = {"keys": {}}
 
+DEFAULT_CURSORS = {"audit": {}}  # "guild_id": last processed audit log entry id
+
+DEFAULT_BASELINES = {}  # "guild_id": {"channels"|"roles"|"webhooks": {"object_id": fingerprint}}
+
+DEFAULT_THREATS = {}  # "user_id": [expires_ts, guild_id, reason]
+
+DEFAULT_OFFENSES = {}  # "guild_id:user_id": [decaying offense score, last offense ts]
+
 os.makedirs(DATA_DIR, exist_ok=True)
-if not os.path.exists(DATA_FILE):
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(DEFAULT_DATA, f, indent=2)
-if not os.path.exists(LICENSE_FILE):
-    with open(LICENSE_FILE, "w", encoding="utf-8") as f:
-        json.dump(DEFAULT_LICENSES, f, indent=2)
+
+# ---------- metrics ----------
+# Counters/histograms kept in process and served as Prometheus text on
+# METRICS_HOST:METRICS_PORT (+CLUSTER_ID in cluster mode); METRICS_PORT=0 disables it.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+if METRICS_PORT > 0:
+    METRICS_PORT += int(os.getenv("CLUSTER_ID", "0") or 0)
+
+class Metrics:
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.counters = defaultdict(float)  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self.gauges = {}  # name -> callable returning [(labels, value), ...]
+        self.help = {}
+
+    def inc(self, name, labels=(), value=1):
+        self.counters[(name, labels)] += value
+
+    def observe(self, name, value, labels=()):
+        h = self.histograms.get((name, labels))
+        if h is None:
+            h = self.histograms[(name, labels)] = [0] * (len(self.BUCKETS) + 1) + [0.0]
+        for i, b in enumerate(self.BUCKETS):
+            if value <= b:
+                h[i] += 1
+                break
+        else:
+            h[len(self.BUCKETS)] += 1
+        h[-1] += value
+
+    def gauge(self, name, fn, help_text=""):
+        self.gauges[name] = fn
+        if help_text:
+            self.help[name] = help_text
+
+    def counter_value(self, name, labels=()):
+        return self.counters.get((name, labels), 0)
+
+    def histogram_summary(self, name, labels=()):
+        # (count, mean, approx p95) from bucket counts
+        h = self.histograms.get((name, labels))
+        if not h:
+            return 0, 0.0, 0.0
+        counts = h[:-1]
+        total = sum(counts)
+        if not total:
+            return 0, 0.0, 0.0
+        target, seen, p95 = total * 0.95, 0, float("inf")
+        for i, c in enumerate(counts):
+            seen += c
+            if seen >= target:
+                p95 = self.BUCKETS[i] if i < len(self.BUCKETS) else float("inf")
+                break
+        return total, h[-1] / total, p95
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        inner = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+        return "{" + inner + "}"
+
+    def render(self) -> str:
+        out = []
+        typed = set()
+        for (name, labels), v in sorted(self.counters.items()):
+            if name not in typed:
+                typed.add(name)
+                out.append(f"# TYPE {name} counter")
+            out.append(f"{name}{self._labels(labels)} {v:g}")
+        for (name, labels), h in sorted(self.histograms.items()):
+            if name not in typed:
+                typed.add(name)
+                out.append(f"# TYPE {name} histogram")
+            cum = 0
+            for i, b in enumerate(self.BUCKETS):
+                cum += h[i]
+                out.append(f"{name}_bucket{self._labels(labels + (('le', f'{b:g}'),))} {cum}")
+            cum += h[len(self.BUCKETS)]
+            out.append(f"{name}_bucket{self._labels(labels + (('le', '+Inf'),))} {cum}")
+            out.append(f"{name}_sum{self._labels(labels)} {h[-1]:.6f}")
+            out.append(f"{name}_count{self._labels(labels)} {cum}")
+        for name, fn in sorted(self.gauges.items()):
+            try:
+                samples = fn()
+            except Exception:
+                continue
+            if name in self.help:
+                out.append(f"# HELP {name} {self.help[name]}")
+            out.append(f"# TYPE {name} gauge")
+            for labels, v in samples:
+                out.append(f"{name}{self._labels(labels)} {v:g}")
+        return "\n".join(out) + "\n"
+
+metrics = Metrics()
+
+def observe_storage(op: str, doc: str, start: float):
+    labels = (("op", op), ("doc", doc))
+    metrics.inc("bot_storage_ops_total", labels)
+    metrics.observe("bot_storage_seconds", time.perf_counter() - start, labels)
+
+def instrumented(fn):
+    # wraps an event handler with a per-handler event counter and latency histogram
+    labels = (("handler", fn.__name__),)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        metrics.inc("bot_events_total", labels)
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            metrics.inc("bot_handler_errors_total", labels)
+            raise
+        finally:
+            metrics.observe("bot_handler_seconds", time.perf_counter() - start, labels)
+    return wrapper
+
+def rest_route(method: str, url) -> str:
+    # /api/v10/channels/123/messages -> "GET /channels/{id}/messages"; webhook/interaction tokens masked
+    parts = [p for p in url.path.split("/") if p]
+    if len(parts) >= 2 and parts[0] == "api" and parts[1].startswith("v"):
+        parts = parts[2:]
+    norm = []
+    for i, p in enumerate(parts):
+        if p.isdigit():
+            norm.append("{id}")
+        elif i >= 2 and parts[i - 2] in ("webhooks", "interactions") and parts[i - 1].isdigit():
+            norm.append("{token}")
+        else:
+            norm.append(p)
+    return f"{method} /" + "/".join(norm)
+
+async def _trace_request_end(session, ctx, params):
+    labels = (("route", rest_route(params.method, params.url)),)
+    metrics.inc("bot_rest_requests_total", labels)
+    if params.response.status == 429:
+        metrics.inc("bot_rest_429_total", labels)
+
+async def _trace_request_exception(session, ctx, params):
+    metrics.inc("bot_rest_errors_total", (("route", rest_route(params.method, params.url)),))
+
+rest_trace = aiohttp.TraceConfig()
+rest_trace.on_request_end.append(_trace_request_end)
+rest_trace.on_request_exception.append(_trace_request_exception)
+
+# ---------- state store ----------
+# STATE_STORE=json keeps one file per document in data/ (default).
+# STATE_STORE=sqlite keeps them in data/state.db (WAL) so several processes can
+# share licenses/whitelists/settings; cluster mode always uses sqlite.
+# Every store exposes get/put/version; version changes when any process writes.
+# update(name, fn) is the read-modify-write: fn mutates the doc in place and
+# its result is returned with the new version; the doc is only written if fn
+# changed it. On sqlite it runs in one BEGIN IMMEDIATE transaction, so workers
+# updating the same doc serialize instead of overwriting each other.
+STATE_STORE = os.getenv("STATE_STORE", "sqlite" if RUN_MODE == "cluster" else "json").strip().lower()
+STATE_DB_FILE = os.path.join(DATA_DIR, "state.db")
+STORE_DEFAULTS = {"security": DEFAULT_DATA, "licenses": DEFAULT_LICENSES, "cursors": DEFAULT_CURSORS, "baselines": DEFAULT_BASELINES, "threats": DEFAULT_THREATS, "offenses": DEFAULT_OFFENSES}
+
+class JsonFileStore:
+    def __init__(self, paths: dict):
+        self.paths = paths
+        for name, path in paths.items():
+            if not os.path.exists(path):
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(STORE_DEFAULTS[name], f, indent=2)
+
+    def get(self, name):
+        with open(self.paths[name], "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def put(self, name, doc):
+        with open(self.paths[name], "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=2)
+
+    def update(self, name, fn):
+        # single process: the storage executor already serializes writers
+        doc = self.get(name)
+        before = json.dumps(doc)
+        result = fn(doc)
+        if json.dumps(doc) != before:
+            self.put(name, doc)
+        return result, self.version(name)
+
+    def version(self, name):
+        try:
+            return os.stat(self.paths[name]).st_mtime_ns
+        except OSError:
+            return 0
+
+class SqliteStore:
+    def __init__(self, path: str, seed_paths: dict = None):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS docs (name TEXT PRIMARY KEY, body TEXT NOT NULL, version INTEGER NOT NULL)")
+        # first run: import the existing json files so switching stores keeps state
+        for name, default in STORE_DEFAULTS.items():
+            if self.version(name):
+                continue
+            doc = default
+            path = (seed_paths or {}).get(name)
+            if path and os.path.exists(path):
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        doc = json.load(f)
+                except Exception as e:
+                    print(f"[!] Could not import {path} into state store: {e}")
+            self.conn.execute("INSERT OR IGNORE INTO docs (name, body, version) VALUES (?, ?, 1)", (name, json.dumps(doc)))
+
+    def get(self, name):
+        with self.lock:
+            row = self.conn.execute("SELECT body FROM docs WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else json.loads(json.dumps(STORE_DEFAULTS[name]))
+
+    def put(self, name, doc):
+        body = json.dumps(doc)
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO docs (name, body, version) VALUES (?, ?, 1) "
+                "ON CONFLICT(name) DO UPDATE SET body = excluded.body, version = docs.version + 1",
+                (name, body),
+            )
+
+    def update(self, name, fn):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT body, version FROM docs WHERE name = ?", (name,)).fetchone()
+                body, version = row if row else (json.dumps(STORE_DEFAULTS[name]), 0)
+                doc = json.loads(body)
+                result = fn(doc)
+                new_body = json.dumps(doc)
+                if new_body != body:
+                    self.conn.execute(
+                        "INSERT INTO docs (name, body, version) VALUES (?, ?, 1) "
+                        "ON CONFLICT(name) DO UPDATE SET body = excluded.body, version = docs.version + 1",
+                        (name, new_body),
+                    )
+                    version += 1
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return result, version
+
+    def version(self, name):
+        with self.lock:
+            row = self.conn.execute("SELECT version FROM docs WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+class MemoryStore:
+    """In-process stand-in for tests/benchmarks; same interface, no disk."""
+    def __init__(self, docs: dict = None):
+        self.docs = {}
+        self.versions = defaultdict(int)
+        for name, default in STORE_DEFAULTS.items():
+            self.put(name, (docs or {}).get(name, default))
+
+    def get(self, name):
+        return json.loads(self.docs[name])
+
+    def put(self, name, doc):
+        self.docs[name] = json.dumps(doc)
+        self.versions[name] += 1
+
+    def update(self, name, fn):
+        doc = self.get(name)
+        result = fn(doc)
+        if json.dumps(doc) != self.docs[name]:
+            self.put(name, doc)
+        return result, self.versions[name]
+
+    def version(self, name):
+        return self.versions[name]
+
+def open_store(kind: str):
+    paths = {"security": DATA_FILE, "licenses": LICENSE_FILE, "cursors": CURSOR_FILE, "baselines": BASELINE_FILE, "threats": THREAT_FILE, "offenses": OFFENSE_FILE}
+    if kind == "sqlite":
+        return SqliteStore(STATE_DB_FILE, seed_paths=paths)
+    if kind == "memory":
+        return MemoryStore()
+    return JsonFileStore(paths)
+
+store = open_store(STATE_STORE)
+
+# last version of each document this process has loaded into memory
+store_versions = {}
 
 # ---------- helpers to load/save ----------
 def load_data():
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    start = time.perf_counter()
+    try:
+        return store.get("security")
+    finally:
+        observe_storage("load", "security", start)
 
 def save_data(d):
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(d, f, indent=2)
+    start = time.perf_counter()
+    try:
+        store.put("security", d)
+        store_versions["security"] = store.version("security")
+    finally:
+        observe_storage("save", "security", start)
+
+def update_data(fn):
+    # returns fn's result and the updated doc; callers on the event loop swap
+    # the doc in with apply_data_update (aupdate_data does both)
+    start = time.perf_counter()
+    out = {}
+    def apply(doc):
+        result = fn(doc)
+        out["doc"] = json.loads(json.dumps(doc))
+        return result
+    try:
+        result, store_versions["security"] = store.update("security", apply)
+        return result, out["doc"]
+    finally:
+        observe_storage("update", "security", start)
 
 def load_licenses():
-    with open(LICENSE_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    start = time.perf_counter()
+    try:
+        return store.get("licenses")
+    finally:
+        observe_storage("load", "licenses", start)
 
 def save_licenses(l):
-    with open(LICENSE_FILE, "w", encoding="utf-8") as f:
-        json.dump(l, f, indent=2)
+    start = time.perf_counter()
+    try:
+        store.put("licenses", l)
+        store_versions["licenses"] = store.version("licenses")
+    finally:
+        observe_storage("save", "licenses", start)
+
+def update_licenses(fn):
+    # returns fn's result and the updated doc for apply_licenses_update
+    start = time.perf_counter()
+    out = {}
+    def apply(doc):
+        result = fn(doc)
+        out["doc"] = json.loads(json.dumps(doc))
+        return result
+    try:
+        result, store_versions["licenses"] = store.update("licenses", apply)
+        return result, out["doc"]
+    finally:
+        observe_storage("update", "licenses", start)
+
+# Blocking store I/O from async code runs on one dedicated thread so a slow
+# disk never stalls the gateway heartbeat; a single worker keeps writes ordered.
+storage_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+
+async def run_blocking(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(storage_executor, functools.partial(fn, *args))
 
+# the loop only keeps weak references to tasks, so fire-and-forget work is
+# held here until it finishes
+background_tasks = set()
+
+def spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def aload_data():
+    return await run_blocking(load_data)
+
+async def aupdate_data(fn):
+    result, doc = await run_blocking(update_data, fn)
+    apply_data_update(doc)
+    return result
+
+async def aload_licenses():
+    return await run_blocking(load_licenses)
+
+async def aupdate_licenses(fn):
+    result, doc = await run_blocking(update_licenses, fn)
+    apply_licenses_update(doc)
+    return result
+
+# in-memory copies served to handlers; swapped on the event loop when this
+# process writes (aupdate_data / aupdate_licenses) or store_sync sees a change
 data = load_data()
 licenses = load_licenses()
 
-intents = discord.Intents.all()
+def apply_licenses_update(new: dict):
+    licenses.clear()
+    licenses.update(new)
+
+store_versions["security"] = store.version("security")
+store_versions["licenses"] = store.version("licenses")
+
+# ---------------- Runtime profile ----------------
+# RUNTIME_PROFILE in .env: full (everything cached/chunked), lean, minimal.
+# lean/minimal only request the intents the anti features use, keep a bounded
+# member/message cache and skip chunking; members are fetched on demand.
+BOOT_TS = time.monotonic()
+RUNTIME_PROFILE = os.getenv("RUNTIME_PROFILE", "full").strip().lower()
+RUNTIME_PROFILES = {
+    "full": {"member_cache": "all", "max_messages": 1000, "chunk": True},
+    "lean": {"member_cache": "joined", "max_messages": 200, "chunk": False},
+    "minimal": {"member_cache": "none", "max_messages": None, "chunk": False},
+}
+if RUNTIME_PROFILE not in RUNTIME_PROFILES:
+    print(f"[!] Unknown RUNTIME_PROFILE {RUNTIME_PROFILE!r}, using full")
+    RUNTIME_PROFILE = "full"
+
+def build_intents(profile: str) -> discord.Intents:
+    if profile == "full":
+        return discord.Intents.all()
+    it = discord.Intents.none()
+    it.guilds = True  # channel/role/guild update events
+    it.guild_messages = True  # spam detection + prefix commands
+    it.message_content = True
+    it.dm_messages = True  # master owner commands in DM
+    it.moderation = True  # bans / audit log
+    it.webhooks = True  # on_webhooks_update
+    it.members = profile != "minimal"  # join events + cache of joined members
+    return it
+
+def build_member_cache_flags(profile: str) -> discord.MemberCacheFlags:
+    mode = RUNTIME_PROFILES[profile]["member_cache"]
+    if mode == "all":
+        return discord.MemberCacheFlags.all()
+    flags = discord.MemberCacheFlags.none()
+    if mode == "joined":
+        flags.joined = True
+    return flags
+
+def build_max_messages(profile: str):
+    raw = os.getenv("MAX_MESSAGES", "").strip()
+    if raw:
+        return int(raw) or None
+    return RUNTIME_PROFILES[profile]["max_messages"]
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except Exception:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except Exception:
+        return 0.0
+
+# ---------------- Run mode / sharding ----------------
+# RUN_MODE=single (one connection) or sharded (AutoShardedBot).
+# SHARD_COUNT / SHARD_IDS ("0,1,2") pin the shards this process owns.
+
+def shard_options() -> dict:
+    if RUN_MODE != "sharded":
+        return {}
+    opts = {}
+    count = os.getenv("SHARD_COUNT", "").strip()
+    ids = os.getenv("SHARD_IDS", "").strip()
+    if count:
+        opts["shard_count"] = int(count)
+    if ids:
+        if not count:
+            raise SystemExit("SHARD_IDS requires SHARD_COUNT in .env")
+        opts["shard_ids"] = [int(x) for x in ids.split(",") if x.strip()]
+    return opts
+
+BotClass = commands.AutoShardedBot if RUN_MODE == "sharded" else commands.Bot
+
+intents = build_intents(RUNTIME_PROFILE)
 client = discord.Client(intents=intents)
-bot = commands.Bot(command_prefix="!", intents=intents)
+bot = BotClass(
+    command_prefix="!",
+    intents=intents,
+    member_cache_flags=build_member_cache_flags(RUNTIME_PROFILE),
+    max_messages=build_max_messages(RUNTIME_PROFILE),
+    chunk_guilds_at_startup=RUNTIME_PROFILES[RUNTIME_PROFILE]["chunk"],
+    http_trace=rest_trace,
+    **shard_options(),
+)
 
-# trackers
+# filled on first on_ready, see runtime_report()
+ready_stats = {}
+
+# trackers (keyed by (guild_id, user_id) so state stays with the guild's shard)
 spam_tracker = defaultdict(lambda: deque())
 spam_strikes = defaultdict(int)
 join_tracker = defaultdict(lambda: deque())
@@ -99,6 +604,79 @@ recent_logs = defaultdict(lambda: defaultdict(float))
 recent_renames = defaultdict(lambda: deque())
 recent_channel_creations = defaultdict(lambda: deque())
 
+# ---------------- Shard health ----------------
+class ShardHealth:
+    """Per-shard readiness and event-rate counters (shard 0 in single mode)."""
+    __slots__ = ("shard_id", "ready", "ready_at", "events_total", "disconnects", "resumes",
+                 "_window_start", "_window_count", "events_per_sec")
+
+    WINDOW = 10.0
+
+    def __init__(self, shard_id):
+        self.shard_id = shard_id
+        self.ready = False
+        self.ready_at = None
+        self.events_total = 0
+        self.disconnects = 0
+        self.resumes = 0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self.events_per_sec = 0.0
+
+    def note_event(self):
+        now = time.monotonic()
+        self.events_total += 1
+        self._window_count += 1
+        elapsed = now - self._window_start
+        if elapsed >= self.WINDOW:
+            self.events_per_sec = self._window_count / elapsed
+            self._window_start = now
+            self._window_count = 0
+
+    def rate(self):
+        # tumbling window; decay to the live value if no event closed the window
+        elapsed = time.monotonic() - self._window_start
+        if elapsed >= self.WINDOW:
+            return self._window_count / elapsed
+        return self.events_per_sec
+
+shard_health = {}
+
+def get_shard_health(shard_id) -> ShardHealth:
+    h = shard_health.get(shard_id)
+    if h is None:
+        h = shard_health[shard_id] = ShardHealth(shard_id)
+    return h
+
+def note_shard_event(guild):
+    if guild is not None:
+        get_shard_health(guild.shard_id).note_event()
+
+def shard_is_ready(guild) -> bool:
+    if RUN_MODE != "sharded":
+        return True
+    h = shard_health.get(guild.shard_id)
+    return bool(h and h.ready)
+
+def shard_latencies():
+    if RUN_MODE == "sharded":
+        return list(bot.latencies)
+    return [(0, bot.latency)]
+
+def shard_report():
+    lines = ["Shard | state | latency | guilds | events | ev/s | disc | resumes"]
+    guild_counts = defaultdict(int)
+    for g in bot.guilds:
+        guild_counts[g.shard_id] += 1
+    for sid, lat in shard_latencies():
+        h = get_shard_health(sid)
+        lat_ms = f"{lat * 1000:.0f}ms" if lat == lat and lat != float("inf") else "n/a"
+        lines.append(
+            f"{sid} | {'ready' if h.ready else 'pending'} | {lat_ms} | {guild_counts[sid]} | "
+            f"{h.events_total} | {h.rate():.2f} | {h.disconnects} | {h.resumes}"
+        )
+    return lines
+
 # in-memory map of panel messages (guild_id -> message_id)
 panel_message_map = {int(k): int(v) for k, v in data.get("panel_messages", {}).items()}
 
@@ -110,6 +688,104 @@ def shell_block(lines):
         body = str(lines)
     return f"```shell\n{body}\n```"
 
+# ---------------- Per-guild policy ----------------
+# Toggles and thresholds below can be overridden per guild in data["guild_settings"].
+# Handlers read them through get_policy(guild_id), which returns a precompiled
+# read-only object; it is rebuilt only when that guild's settings change.
+POLICY_BOOL_KEYS = (
+    "anti_channel_create",
+    "anti_channel_delete",
+    "anti_role_create",
+    "anti_role_delete",
+    "anti_role_update",
+    "anti_webhook",
+    "anti_raid",
+    "anti_ban",
+    "anti_nuke",
+    "auto_ban",
+    "auto_kick",
+    "auto_timeout",
+    "anti_link",
+    "block_invites",
+    "escalation",
+    "escalation_standalone",
+)
+POLICY_INT_KEYS = (
+    "rate_limit_hours",
+    "spam_delete_threshold",
+    "spam_delete_window",
+    "spam_strike_timeout_threshold",
+    "spam_dup_authors",
+    "spam_dup_window",
+)
+POLICY_KEYS = POLICY_BOOL_KEYS + POLICY_INT_KEYS
+
+class GuildPolicy:
+    """Global defaults merged with one guild's overrides, coerced once at build time."""
+    __slots__ = ("guild_id",) + POLICY_KEYS
+
+    def __init__(self, guild_id, settings: dict):
+        object.__setattr__(self, "guild_id", guild_id)
+        for k in POLICY_BOOL_KEYS:
+            object.__setattr__(self, k, bool(settings.get(k, DEFAULT_DATA[k])))
+        for k in POLICY_INT_KEYS:
+            try:
+                v = int(settings.get(k, DEFAULT_DATA[k]))
+            except (TypeError, ValueError):
+                v = DEFAULT_DATA[k]
+            object.__setattr__(self, k, v)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GuildPolicy is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("GuildPolicy is read-only")
+
+    def __repr__(self):
+        return f"<GuildPolicy guild={self.guild_id}>"
+
+# guild_id -> GuildPolicy (None key = global defaults, e.g. for DMs)
+guild_policies = {}
+
+def compile_policy(guild_id, d=None):
+    d = data if d is None else d
+    merged = {k: d.get(k, DEFAULT_DATA[k]) for k in POLICY_KEYS}
+    if guild_id is not None:
+        merged.update(d.get("guild_settings", {}).get(str(guild_id), {}))
+    return GuildPolicy(guild_id, merged)
+
+def get_policy(guild_id) -> GuildPolicy:
+    p = guild_policies.get(guild_id)
+    if p is None:
+        p = guild_policies[guild_id] = compile_policy(guild_id)
+    return p
+
+def update_guild_settings(guild_id: int, changes: dict) -> dict:
+    # returns the updated security doc for apply_data_update
+    unknown = set(changes) - set(POLICY_KEYS)
+    if unknown:
+        raise KeyError(f"Unknown guild setting(s): {', '.join(sorted(unknown))}")
+    def apply(d):
+        d.setdefault("guild_settings", {}).setdefault(str(guild_id), {}).update(changes)
+    return update_data(apply)[1]
+
+def panel_status_text(p: GuildPolicy) -> str:
+    def onoff(v):
+        return "ON" if v else "OFF"
+    return (
+        f"Auto-Kick: {onoff(p.auto_kick)}\n"
+        f"Auto-Timeout: {onoff(p.auto_timeout)}\n"
+        f"Anti-ChannelCreate: {onoff(p.anti_channel_create)}\n"
+        f"Anti-ChannelDelete: {onoff(p.anti_channel_delete)}\n"
+        f"Anti-RoleCreate: {onoff(p.anti_role_create)}\n"
+        f"Anti-RoleDelete: {onoff(p.anti_role_delete)}\n"
+        f"Anti-RoleUpdate: {onoff(p.anti_role_update)}\n"
+        f"Anti-Webhook: {onoff(p.anti_webhook)}\n"
+        f"Anti-Rename: {onoff(p.anti_raid)}\n"
+        f"Anti-Link: {onoff(p.anti_link)} (invites: {onoff(p.block_invites)})\n"
+        f"Escalation: {onoff(p.escalation)} (standalone: {onoff(p.escalation_standalone)})"
+    )
+
 # ---------------- Licensing helpers ----------------
 def generate_key(length: int = 32) -> str:
     return secrets.token_hex(length//2) if length % 2 == 0 else secrets.token_hex((length+1)//2)
@@ -132,8 +808,26 @@ def make_expiry(duration: str):
         return "permanent"
     return (datetime.now(timezone.utc) + timedelta(days=7)).isoformat()
 
-def license_valid_for_guild(guild_id: int):
-    l = load_licenses()
+def licensed_guild_ids(l=None):
+    # one pass over the key list, for bulk callers (startup provisioning)
+    l = licenses if l is None else l
+    now = datetime.now(timezone.utc)
+    out = set()
+    for v in l.get("keys", {}).values():
+        gid = v.get("guild_id")
+        if not gid:
+            continue
+        exp = v.get("expires_at")
+        if exp == "permanent":
+            out.add(gid)
+            continue
+        exp_dt = iso_to_dt(exp) if exp else None
+        if exp_dt and exp_dt > now:
+            out.add(gid)
+    return out
+
+def license_valid_for_guild(guild_id: int, l=None):
+    l = licenses if l is None else l
     keys = l.get("keys", {})
     for _, v in keys.items():
         if v.get("guild_id") == guild_id:
@@ -148,8 +842,8 @@ def license_valid_for_guild(guild_id: int):
                 continue
     return False
 
-def key_is_valid_and_avail(key: str):
-    l = load_licenses()
+def key_is_valid_and_avail(key: str, l=None):
+    l = licenses if l is None else l
     keys = l.get("keys", {})
     if key not in keys:
         return False, "Key not found"
@@ -168,6 +862,9 @@ def key_is_valid_and_avail(key: str):
 async def post_webhook(msg: str):
     if not WEBHOOK_URL:
         return
+    if overload.shedding:
+        overload.defer_webhook(msg)
+        return
     try:
         async with aiohttp.ClientSession() as sess:
             await sess.post(WEBHOOK_URL, json={"content": msg})
@@ -183,23 +880,71 @@ async def find_guild():
             pass
     return bot.guilds[0] if bot.guilds else None
 
-async def ensure_channel(guild: discord.Guild, name: str):
-    ch = discord.utils.get(guild.text_channels, name=name)
-    if ch:
-        return ch
+async def resolve_member(guild: discord.Guild, actor):
+    # cache first; lean/minimal profiles don't chunk, so fall back to one REST fetch
+    if isinstance(actor, discord.Member):
+        return actor
+    aid = getattr(actor, "id", None)
+    if not aid:
+        return None
+    member = guild.get_member(aid)
+    if member:
+        return member
     try:
-        return await guild.create_text_channel(name, reason="Create security system channel")
+        return await guild.fetch_member(aid)
     except Exception:
         return None
 
+def runtime_report():
+    members = sum(len(g.members) for g in bot.guilds)
+    return [
+        f"Profile: {RUNTIME_PROFILE}",
+        f"Intents: {intents.value}",
+        f"Chunk at startup: {RUNTIME_PROFILES[RUNTIME_PROFILE]['chunk']}",
+        f"Max messages: {bot._connection.max_messages}",
+        f"Ready in: {ready_stats.get('ready_seconds', 0):.2f}s",
+        f"RSS at ready: {ready_stats.get('ready_rss_mb', 0):.1f} MB",
+        f"Provisioned guilds: {ready_stats.get('provisioned_guilds', 0)} in {ready_stats.get('provision_seconds', 0):.2f}s",
+        f"Audit catch-up: {ready_stats.get('audit_catchup', 'n/a')}",
+        f"RSS now: {current_rss_mb():.1f} MB",
+        f"Guilds: {len(bot.guilds)}",
+        f"Cached members: {members}",
+        f"Cached messages: {len(bot.cached_messages)}",
+    ]
+
+# (guild_id, name) -> channel/role id, warmed by provision_guilds()
+system_channel_ids = {}
+system_role_ids = {}
+
+async def ensure_channel(guild: discord.Guild, name: str):
+    cid = system_channel_ids.get((guild.id, name))
+    if cid:
+        ch = guild.get_channel(cid)
+        if ch and ch.name == name:
+            return ch
+    ch = discord.utils.get(guild.text_channels, name=name)
+    if not ch:
+        try:
+            ch = await guild.create_text_channel(name, reason="Create security system channel")
+        except Exception:
+            return None
+    system_channel_ids[(guild.id, name)] = ch.id
+    return ch
+
 async def ensure_role(guild: discord.Guild, name: str):
+    rid = system_role_ids.get((guild.id, name))
+    if rid:
+        r = guild.get_role(rid)
+        if r and r.name == name:
+            return r
     r = discord.utils.get(guild.roles, name=name)
-    if r:
-        return r
-    try:
-        return await guild.create_role(name=name, reason="Create verify role")
-    except Exception:
-        return None
+    if not r:
+        try:
+            r = await guild.create_role(name=name, reason="Create verify role")
+        except Exception:
+            return None
+    system_role_ids[(guild.id, name)] = r.id
+    return r
 
 async def ensure_shame_channel(guild):
     return await ensure_channel(guild, data.get("shame_channel_name", "shame"))
@@ -208,69 +953,289 @@ async def ensure_logs_channel(guild):
     return await ensure_channel(guild, data.get("logs_channel_name", "security-logs"))
 
 # ---------------- Per-guild whitelist helpers ----------------
-def get_whitelist_for_guild(guild_id: int):
-    d = load_data()
-    wl = d.get("whitelists", {})
-    lst = wl.get(str(guild_id), [])
-    return set(int(x) for x in lst)
-
-def is_whitelisted(guild_id: int, user_id: int) -> bool:
-    wl = get_whitelist_for_guild(guild_id)
+def build_whitelist_sets(d: dict) -> dict:
+    return {int(g): frozenset(int(x) for x in ids) for g, ids in d.get("whitelists", {}).items()}
+
+# guild -> frozenset of user IDs for the in-memory doc, rebuilt by apply_data_update
+whitelist_sets = build_whitelist_sets(data)
+
+def get_whitelist_for_guild(guild_id: int, d=None):
+    # served from the validated in-memory doc unless another doc is passed in
+    if d is None or d is data:
+        return whitelist_sets.get(int(guild_id), frozenset())
+    return frozenset(int(x) for x in d.get("whitelists", {}).get(str(guild_id), []))
+
+def is_whitelisted(guild_id: int, user_id: int, d=None) -> bool:
+    wl = get_whitelist_for_guild(guild_id, d)
     return int(user_id) in wl
 
 def add_whitelist_guild(guild_id: int, user_id: int):
-    d = load_data()
-    d.setdefault("whitelists", {})
-    lst = d["whitelists"].setdefault(str(guild_id), [])
-    if int(user_id) not in lst:
-        lst.append(int(user_id))
-    d["whitelists"][str(guild_id)] = sorted(list(set(lst)))
-    save_data(d)
+    return edit_whitelist_guild(guild_id, [user_id], add=True)
 
 def remove_whitelist_guild(guild_id: int, user_id: int):
-    d = load_data()
-    d.setdefault("whitelists", {})
-    lst = d["whitelists"].get(str(guild_id), [])
-    lst = [int(x) for x in lst if int(x) != int(user_id)]
-    d["whitelists"][str(guild_id)] = lst
-    save_data(d)
+    return edit_whitelist_guild(guild_id, [user_id], add=False)
+
+def edit_whitelist_guild(guild_id: int, user_ids, add: bool = True):
+    # batch add/remove in a single store update; returns the updated doc for
+    # apply_data_update
+    ids = set(int(u) for u in user_ids)
+    def apply(d):
+        current = set(int(x) for x in d.setdefault("whitelists", {}).get(str(guild_id), []))
+        d["whitelists"][str(guild_id)] = sorted(current | ids if add else current - ids)
+    return update_data(apply)[1]
 
 # ---------------- Timeout compatibility ----------------
 async def timeout_member(member: discord.Member, hours: int, reason: str = "Rate-limited by security bot"):
     if not member or not isinstance(member, discord.Member):
-        return
+        return False
+    # True once the timeout is applied; Forbidden is raised, other errors are logged
     until = datetime.now(timezone.utc) + timedelta(hours=hours)
     try:
         await member.timeout(until=until, reason=reason)
-        return
+        return True
     except TypeError:
         try:
             await member.timeout(until, reason=reason)
-            return
+            return True
+        except discord.Forbidden:
+            raise
         except Exception as e:
             print(f"[!] Failed to timeout (positional) {member}: {e}")
     except AttributeError:
         try:
             await member.edit(timed_out_until=until, reason=reason)
-            return
+            return True
+        except discord.Forbidden:
+            raise
         except Exception as e:
             print(f"[!] Failed to timeout (edit) {member}: {e}")
     except discord.Forbidden:
         raise
     except Exception as e:
         print(f"[!] Timeout error: {e}")
+    return False
+
+def can_moderate(guild: discord.Guild, member) -> bool:
+    # the owner and members at or above the bot's top role cannot be timed out or kicked
+    if member.id == guild.owner_id:
+        return False
+    try:
+        return member.top_role < guild.me.top_role
+    except Exception:
+        return True
+
+# ---------------- Incident journal ----------------
+# Every log_shame_and_record call is appended to data/journal as JSONL
+# segments rotated at JOURNAL_MAX_BYTES, so incidents survive the channel
+# deletions done by revoke/expire_check. The in-memory index maps
+# (guild, actor) and (guild, hour bucket) to packed (segment, offset) positions
+# plus timestamps, so a query reads only the records it returns. Appends and
+# queries run on the storage executor; the startup index rebuild runs on its
+# own thread and only scans up to where the journal ended when it started, so
+# appends keep landing on disk meanwhile and are indexed once it finishes.
+# In cluster mode each worker writes and indexes its own segments (it serves
+# the same guilds' events).
+JOURNAL_DIR = os.path.join(DATA_DIR, "journal")
+JOURNAL_MAX_BYTES = int(os.getenv("JOURNAL_MAX_BYTES", str(16 * 1024 * 1024)))
+JOURNAL_BUCKET_SECONDS = 3600
+JOURNAL_OFFSET_BITS = 40
+
+class IncidentJournal:
+    def __init__(self, directory: str, max_bytes: int, prefix: str = "incidents"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.loaded = False
+        self.loading = False
+        self.opened = False
+        self.lock = threading.Lock()
+        self.pending = []  # (rec, segment, offset) appended while loading
+        self.segment = 0
+        self.segment_size = 0
+        self.records = 0
+        # key -> (packed positions, unix timestamps), appended in time order
+        self.by_actor = {}
+        self.by_bucket = {}
+        self.guild_buckets = defaultdict(list)  # guild -> bucket numbers, ascending
+
+    def _path(self, seg: int) -> str:
+        return os.path.join(self.directory, f"{self.prefix}-{seg:06d}.jsonl")
+
+    def _segments(self):
+        out = []
+        for name in os.listdir(self.directory):
+            if name.startswith(self.prefix + "-") and name.endswith(".jsonl"):
+                try:
+                    out.append(int(name[len(self.prefix) + 1:-6]))
+                except ValueError:
+                    continue
+        return sorted(out)
+
+    def _index(self, rec: dict, seg: int, offset: int):
+        g, a, ts = int(rec["guild_id"]), int(rec["actor_id"] or 0), int(rec["ts"])
+        pos = (seg << JOURNAL_OFFSET_BITS) | offset
+        for table, key in ((self.by_actor, (g, a)), (self.by_bucket, (g, ts // JOURNAL_BUCKET_SECONDS))):
+            entry = table.get(key)
+            if entry is None:
+                entry = table[key] = (array("q"), array("q"))
+                if table is self.by_bucket:
+                    self.guild_buckets[g].append(key[1])
+            entry[0].append(pos)
+            entry[1].append(ts)
+        self.records += 1
+
+    def _open(self):
+        # cheap: find the segment appends go to; the index is built by load()
+        os.makedirs(self.directory, exist_ok=True)
+        segs = self._segments()
+        self.segment = segs[-1] if segs else 1
+        try:
+            self.segment_size = os.path.getsize(self._path(self.segment))
+        except OSError:
+            self.segment_size = 0
+        self.opened = True
+
+    def load(self):
+        with self.lock:
+            if self.loaded or self.loading:
+                return
+            self.loading = True
+            if not self.opened:
+                self._open()
+            end_seg, end_offset = self.segment, self.segment_size
+        try:
+            for seg in self._segments():
+                if seg > end_seg:
+                    break
+                with open(self._path(seg), "rb") as f:
+                    offset = 0
+                    for line in f:
+                        if seg == end_seg and offset >= end_offset:
+                            break
+                        try:
+                            self._index(json.loads(line), seg, offset)
+                        except Exception:
+                            pass  # torn last line after a crash
+                        offset += len(line)
+        except Exception as e:
+            print(f"[!] journal index rebuild failed: {e}")
+        with self.lock:
+            for rec, seg, offset in self.pending:
+                self._index(rec, seg, offset)
+            self.pending = []
+            for buckets in self.guild_buckets.values():
+                buckets.sort()
+            self.loaded = True
+            self.loading = False
+
+    def append(self, rec: dict):
+        try:
+            line = (json.dumps(rec, separators=(",", ":")) + "\n").encode("utf-8")
+            with self.lock:
+                if not self.opened:
+                    self._open()
+                if self.segment_size and self.segment_size + len(line) > self.max_bytes:
+                    self.segment += 1
+                    self.segment_size = 0
+                with open(self._path(self.segment), "ab") as f:
+                    f.write(line)
+                if self.loaded:
+                    self._index(rec, self.segment, self.segment_size)
+                else:
+                    self.pending.append((rec, self.segment, self.segment_size))
+                self.segment_size += len(line)
+        except Exception as e:
+            print(f"[!] journal append failed: {e}")
+
+    def query(self, guild_id: int, actor_id: int = None, since: float = None, until: float = None, limit: int = 20):
+        """Newest-first matching records and the total match count (index must be loaded)."""
+        lo = int(since) if since is not None else None
+        hi = int(until) if until is not None else None
+        if actor_id is not None:
+            sources = [self.by_actor.get((guild_id, int(actor_id)))]
+        else:
+            buckets = self.guild_buckets.get(guild_id, [])
+            sources = [self.by_bucket[(guild_id, b)] for b in reversed(buckets)
+                       if (lo is None or (b + 1) * JOURNAL_BUCKET_SECONDS > lo)
+                       and (hi is None or b * JOURNAL_BUCKET_SECONDS <= hi)]
+        hits, total = [], 0
+        for src in sources:
+            if not src:
+                continue
+            positions, stamps = src
+            for i in range(len(positions) - 1, -1, -1):
+                ts = stamps[i]
+                if (lo is not None and ts < lo) or (hi is not None and ts > hi):
+                    continue
+                total += 1
+                if len(hits) < limit:
+                    hits.append(positions[i])
+        return [self._read(p) for p in hits], total
+
+    def _read(self, pos: int) -> dict:
+        seg, offset = pos >> JOURNAL_OFFSET_BITS, pos & ((1 << JOURNAL_OFFSET_BITS) - 1)
+        with open(self._path(seg), "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+journal = IncidentJournal(JOURNAL_DIR, JOURNAL_MAX_BYTES, prefix=f"incidents-c{os.getenv('CLUSTER_ID')}" if os.getenv("CLUSTER_ID") else "incidents")
+
+def record_incident(guild, uid, action_str: str, status: str):
+    rec = {"ts": round(time.time(), 3), "guild_id": guild.id, "actor_id": uid if isinstance(uid, int) else None,
+           "action": action_str, "status": status}
+    # fire and forget: ordering is kept by the single storage worker
+    asyncio.get_running_loop().run_in_executor(storage_executor, journal.append, rec)
+
+def parse_when(s: str):
+    # "24h" / "30m" / "7d" ago, or an ISO date/datetime (UTC if naive)
+    if not s or s == "-":
+        return None
+    unit = {"m": 60, "h": 3600, "d": 86400}.get(s[-1].lower())
+    if unit and s[:-1].replace(".", "", 1).isdigit():
+        return time.time() - float(s[:-1]) * unit
+    dt = datetime.fromisoformat(s)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+@bot.command(name="incidents")
+@commands.has_permissions(administrator=True)
+async def incidents(ctx: commands.Context, actor: str = "-", since: str = "-", until: str = "-"):
+    """!incidents [actor_id|-] [since] [until] -- since/until: 24h, 7d, 2026-10-01, ..."""
+    if not ctx.guild:
+        return await ctx.send("This command must be used in a guild.")
+    try:
+        actor_id = int(actor.strip("<@!>")) if actor != "-" else None
+        lo, hi = parse_when(since), parse_when(until)
+    except ValueError:
+        return await ctx.send("Usage: !incidents [actor_id|-] [since] [until]  (e.g. !incidents - 24h)", delete_after=12)
+    if not journal.loaded:
+        return await ctx.send("The incident journal is still being indexed, try again shortly.", delete_after=12)
+    records, total = await run_blocking(journal.query, ctx.guild.id, actor_id, lo, hi, 20)
+    if not records:
+        return await ctx.send("No incidents recorded for that filter.")
+    lines = [f"{total} incident(s), newest {len(records)}:"]
+    for r in records:
+        when = datetime.fromtimestamp(r["ts"], timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        lines.append(f"{when} | {r.get('actor_id')} | {r.get('action')} | {r.get('status')}")
+    text = shell_block(lines)
+    await ctx.send(text if len(text) <= 2000 else text[:1990] + "\n```")
 
 # ---------------- Logging (shell-style) ----------------
 async def log_shame_and_record(guild, attacker, action_str: str, status: str = "BLOCKED/LOGGED"):
     uid = getattr(attacker, "id", attacker)
+    metrics.inc("bot_incidents_total", (("status", status),))
+    record_incident(guild, uid, action_str, status)
     key = f"{uid}_{action_str}"
     now = asyncio.get_event_loop().time()
-    if recent_logs[guild.id].get(key, 0) + 60 > now:
+    window = OVERLOAD_DEDUPE_WINDOW if overload.shedding else 60
+    if recent_logs[guild.id].get(key, 0) + window > now:
+        metrics.inc("bot_incident_logs_suppressed_total")
+        if overload.shedding:
+            overload.drop("duplicate_log")
         return
     recent_logs[guild.id][key] = now
 
-    shame_ch = await ensure_shame_channel(guild)
-    logs_ch = await ensure_logs_channel(guild)
     timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d • %H:%M:%S UTC")
     attacker_mention = f"<@{uid}>"
     lines = [
@@ -283,6 +1248,17 @@ async def log_shame_and_record(guild, attacker, action_str: str, status: str = "
         "──────────────────────────────────────"
     ]
     payload = shell_block(lines)
+    if overload.shedding:
+        # overloaded: skip #shame, post to logs in the background so the
+        # punish/revert that follows this call is not held up by alert sends
+        overload.drop("shame_post")
+        spawn(send_alert(guild, payload, include_shame=False))
+        return
+    await send_alert(guild, payload)
+
+async def send_alert(guild, payload: str, include_shame: bool = True):
+    shame_ch = await ensure_shame_channel(guild) if include_shame else None
+    logs_ch = await ensure_logs_channel(guild)
     for ch in (shame_ch, logs_ch):
         if ch:
             try:
@@ -290,6 +1266,233 @@ async def log_shame_and_record(guild, attacker, action_str: str, status: str = "
             except Exception:
                 pass
 
+# ---------------- Cross-guild threat list ----------------
+# Everyone fast_punish/handle_attacker actually kicks or times out is kept for
+# THREAT_TTL_HOURS in the "threats" store document (shared by all processes in
+# cluster mode). on_member_join asks a Bloom filter first: a miss, which is
+# almost every join, costs k bit probes regardless of list size; only hits go
+# on to the exact uid -> expiry dict. Bloom bits cannot be cleared, so the
+# filter is rebuilt from the dict once enough entries have expired.
+THREAT_TTL_HOURS = float(os.getenv("THREAT_TTL_HOURS", "72"))
+THREAT_CAPACITY = int(os.getenv("THREAT_CAPACITY", "1000000"))
+THREAT_FP_RATE = float(os.getenv("THREAT_FP_RATE", "0.001"))
+
+class BloomFilter:
+    def __init__(self, capacity: int, fp_rate: float):
+        self.size = max(64, math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: int):
+        # double hashing over one 128-bit digest
+        h = hashlib.blake2b(key.to_bytes(8, "little", signed=False), digest_size=16).digest()
+        h1, h2 = int.from_bytes(h[:8], "little"), int.from_bytes(h[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: int):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: int) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+threats = {}  # user_id -> [expires_ts, guild_id, reason]
+threat_bloom = BloomFilter(THREAT_CAPACITY, THREAT_FP_RATE)
+threats_dirty = {}
+threat_stats = {"joins_checked": 0, "bloom_hits": 0, "blocked": 0, "rebuilds": 0}
+
+def rebuild_threat_bloom():
+    global threat_bloom
+    fresh = BloomFilter(THREAT_CAPACITY, THREAT_FP_RATE)
+    for uid in threats:
+        fresh.add(uid)
+    threat_bloom = fresh
+    threat_stats["rebuilds"] += 1
+
+def merge_threats(doc: dict):
+    now = time.time()
+    for uid, entry in doc.items():
+        uid = int(uid)
+        if entry[0] > now and entry[0] > threats.get(uid, (0,))[0]:
+            if uid not in threats:
+                threat_bloom.add(uid)
+            threats[uid] = entry
+
+def load_threats():
+    merge_threats(store.get("threats"))
+    store_versions["threats"] = store.version("threats")
+
+load_threats()
+
+def record_threat(guild, member, action_str: str):
+    entry = [time.time() + THREAT_TTL_HOURS * 3600, guild.id, action_str[:120]]
+    if member.id not in threats:
+        threat_bloom.add(member.id)
+    threats[member.id] = threats_dirty[member.id] = entry
+    metrics.inc("bot_threats_recorded_total")
+
+def known_threat(user_id: int):
+    if user_id not in threat_bloom:
+        return None
+    threat_stats["bloom_hits"] += 1
+    entry = threats.get(user_id)
+    return entry if entry and entry[0] > time.time() else None
+
+def flush_threats(pending: dict):
+    # merge with what other processes wrote; drop expired entries while at it
+    now = time.time()
+    def merge(doc):
+        for uid, entry in pending.items():
+            doc[str(uid)] = entry
+        for k in [k for k, v in doc.items() if v[0] <= now]:
+            del doc[k]
+        return dict(doc)
+    return store.update("threats", merge)
+
+@tasks.loop(seconds=30)
+async def threat_list_sync():
+    global threats_dirty
+    try:
+        if threats_dirty:
+            pending, threats_dirty = threats_dirty, {}
+            doc, version = await run_blocking(flush_threats, pending)
+            store_versions["threats"] = version
+            merge_threats(doc)
+        else:
+            version = await run_blocking(store.version, "threats")
+            if version != store_versions.get("threats"):
+                store_versions["threats"] = version
+                merge_threats(await run_blocking(store.get, "threats"))
+    except Exception as e:
+        print(f"[!] threat list sync failed: {e}")
+    now = time.time()
+    expired = [uid for uid, entry in threats.items() if entry[0] <= now]
+    for uid in expired:
+        del threats[uid]
+    if expired and threat_bloom.count > 2 * max(1, len(threats)):
+        rebuild_threat_bloom()
+
+# ---------------- Escalation ladder ----------------
+# Every punishment adds one offense to a per-(guild, user) ledger whose score
+# halves every OFFENSE_HALF_LIFE_HOURS. The decayed score picks a rung of
+# ESCALATION_LADDER; reading it is a dict lookup and one pow(), so the punish
+# path pays nothing extra. With the guild's "escalation" toggle on, anti-nuke
+# and spam punishments use the harsher of the configured action (kick, or a
+# rate_limit_hours timeout) and the rung, so repeat offenders climb while a
+# first offense is never punished less than before. With auto_kick and
+# auto_timeout both off nothing is punished unless "escalation_standalone" is
+# on. An offense is recorded only once its punishment went through, and all
+# events within OFFENSE_INCIDENT_SECONDS of the last recorded offense belong to
+# the same incident and count once, so a burst of in-flight messages or audit
+# events cannot climb the ladder by itself. The ledger is kept in the
+# "offenses" store document, merged and flushed like the audit cursors.
+OFFENSE_HALF_LIFE_HOURS = float(os.getenv("OFFENSE_HALF_LIFE_HOURS", "24"))
+OFFENSE_INCIDENT_SECONDS = float(os.getenv("OFFENSE_INCIDENT_SECONDS", "60"))
+ACTION_SEVERITY = {"warn": 0, "timeout": 1, "kick": 2, "ban": 3}
+
+def parse_ladder(spec: str):
+    rungs = []
+    for part in spec.split(","):
+        action, _, hours = part.strip().partition(":")
+        if action not in ACTION_SEVERITY:
+            raise ValueError(f"unknown ladder action: {action}")
+        rungs.append((action, float(hours or 0)))
+    return tuple(rungs)
+
+ESCALATION_LADDER = parse_ladder(os.getenv("ESCALATION_LADDER", "warn,timeout:1,timeout:6,timeout:24,kick,ban"))
+
+offenses = {}  # (guild_id, user_id) -> (score, last offense ts)
+offenses_dirty = False
+
+def offense_score(guild_id: int, user_id: int, now: float = None) -> float:
+    entry = offenses.get((guild_id, user_id))
+    if entry is None:
+        return 0.0
+    now = time.time() if now is None else now
+    return entry[0] * 0.5 ** ((now - entry[1]) / (OFFENSE_HALF_LIFE_HOURS * 3600))
+
+def same_incident(guild_id: int, user_id: int, now: float) -> bool:
+    entry = offenses.get((guild_id, user_id))
+    return entry is not None and now - entry[1] < OFFENSE_INCIDENT_SECONDS
+
+def record_offense(guild_id: int, user_id: int):
+    # called once a punishment went through; repeats within one incident count once
+    global offenses_dirty
+    now = time.time()
+    if same_incident(guild_id, user_id, now):
+        return
+    offenses[(guild_id, user_id)] = (offense_score(guild_id, user_id, now) + 1.0, now)
+    offenses_dirty = True
+
+def next_punishment(p: GuildPolicy, guild_id: int, user_id: int, base):
+    # base: (action, hours) from the fixed policy, or None. Only reads the
+    # ledger: the caller records the offense after punishing.
+    now = time.time()
+    score = offense_score(guild_id, user_id, now)
+    if not same_incident(guild_id, user_id, now):
+        score += 1.0
+    rung = ESCALATION_LADDER[max(1, min(int(score + 0.5), len(ESCALATION_LADDER))) - 1]
+    if not p.escalation:
+        return base
+    if base is None:
+        return rung if p.escalation_standalone else None
+    return max(base, rung, key=lambda s: (ACTION_SEVERITY[s[0]], s[1]))
+
+def load_offenses():
+    for key, (score, ts) in store.get("offenses").items():
+        gid, uid = key.split(":")
+        offenses[(int(gid), int(uid))] = (score, ts)
+
+def save_offenses(snapshot: dict):
+    # entries decayed below a twentieth of an offense are dropped
+    # merged into the stored doc so other workers' entries survive; the newer
+    # timestamp wins per key
+    now = time.time()
+    half_life = OFFENSE_HALF_LIFE_HOURS * 3600
+    def merge(doc):
+        for (gid, uid), (score, ts) in snapshot.items():
+            key = f"{gid}:{uid}"
+            old = doc.get(key)
+            if old is None or ts >= old[1]:
+                doc[key] = [round(score, 4), round(ts, 1)]
+        for k in [k for k, v in doc.items() if v[0] * 0.5 ** ((now - v[1]) / half_life) < 0.05]:
+            del doc[k]
+        return len(doc)
+    return store.update("offenses", merge)[0]
+
+load_offenses()
+
+@tasks.loop(seconds=30)
+async def offense_flush():
+    global offenses_dirty
+    if not offenses_dirty:
+        return
+    offenses_dirty = False
+    try:
+        await run_blocking(save_offenses, dict(offenses))
+        for key in [k for k in offenses if offense_score(*k) < 0.05]:
+            del offenses[key]
+    except Exception as e:
+        offenses_dirty = True
+        print(f"[!] offense ledger flush failed: {e}")
+
+async def ban_member(guild: discord.Guild, member: discord.Member, action_str: str, prefix: str = "Auto-Ban"):
+    if not guild.me.guild_permissions.ban_members:
+        await log_shame_and_record(guild, member, f"Missing ban permission for {action_str}", status="MISSING PERM")
+        return False
+    try:
+        await guild.ban(member, reason=f"{prefix}: {action_str}"[:500], delete_message_seconds=0)
+    except Exception as e:
+        print(f"[!] ban error: {e}")
+        await log_shame_and_record(guild, member, f"Ban failed for {action_str}", status="FAILED")
+        return False
+    record_threat(guild, member, action_str)
+    await log_shame_and_record(guild, member, f"Banned (repeat offender) for {action_str}", status="BANNED")
+    return True
+
 # ---------------- Fast punish (0.1s) ----------------
 async def fast_punish(guild: discord.Guild, actor, action_str: str):
     await asyncio.sleep(0.1)  # requested 0.1s
@@ -298,18 +1501,9 @@ async def fast_punish(guild: discord.Guild, actor, action_str: str):
         await log_shame_and_record(guild, actor, action_str, status="LICENSE INACTIVE - SKIPPED PUNISH")
         return
 
-    d = load_data()
+    p = get_policy(guild.id)
     try:
-        member = actor if isinstance(actor, discord.Member) else None
-        if not member:
-            aid = getattr(actor, "id", None)
-            if aid:
-                member = guild.get_member(aid)
-                if not member:
-                    try:
-                        member = await guild.fetch_member(aid)
-                    except Exception:
-                        member = None
+        member = await resolve_member(guild, actor)
         if not member:
             await log_shame_and_record(guild, actor, f"User not found for fast punish {action_str}", status="USER NOT FOUND")
             return
@@ -326,14 +1520,27 @@ async def fast_punish(guild: discord.Guild, actor, action_str: str):
         except Exception:
             pass
 
+        base = ("kick", 0) if p.auto_kick else ("timeout", p.rate_limit_hours) if p.auto_timeout else None
+        step = next_punishment(p, guild.id, member.id, base)
+        if step and step[0] == "ban":
+            if await ban_member(guild, member, action_str, prefix="Auto-Ban (fast)"):
+                record_offense(guild.id, member.id)
+            return
+        if step and step[0] == "warn":
+            record_offense(guild.id, member.id)
+            await log_shame_and_record(guild, member, f"Warned (first offense) for {action_str}", status="WARNED")
+            return
+
         # Auto-Kick only (primary)
-        if d.get("auto_kick", True):
+        if step and step[0] == "kick":
             if not me.guild_permissions.kick_members:
                 await log_shame_and_record(guild, member, f"Missing kick permission for fast punish {action_str}", status="MISSING PERM")
                 return
             try:
                 # no DM — silent quick kick
                 await member.kick(reason=f"Auto-Kick (fast): {action_str}")
+                record_offense(guild.id, member.id)
+                record_threat(guild, member, action_str)
                 await log_shame_and_record(guild, member, f"Auto-Kicked (fast) for {action_str}", status="AUTO-KICKED")
                 return
             except Exception as e:
@@ -342,13 +1549,17 @@ async def fast_punish(guild: discord.Guild, actor, action_str: str):
                 return
 
         # fallback: timeout
-        if d.get("auto_timeout", True):
+        if step and step[0] == "timeout":
             if not me.guild_permissions.moderate_members:
                 await log_shame_and_record(guild, member, f"Missing timeout permission for fast punish {action_str}", status="MISSING PERM")
                 return
             try:
-                hours = int(d.get("rate_limit_hours", 12))
-                await timeout_member(member, hours, reason=f"Auto-Timeout (fast): {action_str}")
+                hours = step[1]
+                if not await timeout_member(member, hours, reason=f"Auto-Timeout (fast): {action_str}"):
+                    await log_shame_and_record(guild, member, f"Fast timeout failed for {action_str}", status="FAILED")
+                    return
+                record_offense(guild.id, member.id)
+                record_threat(guild, member, action_str)
                 await log_shame_and_record(guild, member, f"Timed Out (fast) for {action_str}", status="TIMED OUT")
                 return
             except Exception as e:
@@ -364,20 +1575,11 @@ async def handle_attacker(guild: discord.Guild, attacker, action_str: str):
     if not license_valid_for_guild(guild.id) and getattr(attacker, "id", None) != MASTER_OWNER_ID:
         await log_shame_and_record(guild, attacker, action_str, status="LICENSE INACTIVE - SKIPPED")
         return
-    d = load_data()
     if not guild or not attacker:
         return
+    p = get_policy(guild.id)
     try:
-        member = attacker if isinstance(attacker, discord.Member) else None
-        if not member:
-            aid = getattr(attacker, "id", None)
-            if aid:
-                member = guild.get_member(aid)
-                if not member:
-                    try:
-                        member = await guild.fetch_member(aid)
-                    except Exception:
-                        member = None
+        member = await resolve_member(guild, attacker)
         if not member:
             await log_shame_and_record(guild, attacker, f"User not found during {action_str}", status="USER NOT FOUND")
             return
@@ -393,12 +1595,25 @@ async def handle_attacker(guild: discord.Guild, attacker, action_str: str):
         except Exception:
             pass
 
-        if d.get("auto_kick", True):
+        base = ("kick", 0) if p.auto_kick else ("timeout", p.rate_limit_hours) if p.auto_timeout else None
+        step = next_punishment(p, guild.id, member.id, base)
+        if step and step[0] == "ban":
+            if await ban_member(guild, member, action_str):
+                record_offense(guild.id, member.id)
+            return
+        if step and step[0] == "warn":
+            record_offense(guild.id, member.id)
+            await log_shame_and_record(guild, member, f"Warned (first offense) for {action_str}", status="WARNED")
+            return
+
+        if step and step[0] == "kick":
             if not me.guild_permissions.kick_members:
                 await log_shame_and_record(guild, member, f"Missing kick permission for {action_str}", status="MISSING PERM")
                 return
             try:
                 await member.kick(reason=f"Auto-Kick: {action_str}")
+                record_offense(guild.id, member.id)
+                record_threat(guild, member, action_str)
                 await log_shame_and_record(guild, member, f"Auto-Kicked for {action_str}", status="AUTO-KICKED")
                 return
             except discord.Forbidden:
@@ -409,13 +1624,17 @@ async def handle_attacker(guild: discord.Guild, attacker, action_str: str):
                 await log_shame_and_record(guild, member, f"Kick failed for {action_str}", status="FAILED")
                 return
 
-        if d.get("auto_timeout", True):
+        if step and step[0] == "timeout":
             if not me.guild_permissions.moderate_members:
                 await log_shame_and_record(guild, member, f"Missing timeout permission for {action_str}", status="MISSING PERM")
                 return
             try:
-                hours = int(d.get("rate_limit_hours", 12))
-                await timeout_member(member, hours, reason=action_str)
+                hours = step[1]
+                if not await timeout_member(member, hours, reason=action_str):
+                    await log_shame_and_record(guild, member, f"Timeout failed for {action_str}", status="FAILED")
+                    return
+                record_offense(guild.id, member.id)
+                record_threat(guild, member, action_str)
                 await log_shame_and_record(guild, member, f"Timed Out for {action_str}", status="TIMED OUT")
                 return
             except discord.Forbidden:
@@ -430,25 +1649,93 @@ async def handle_attacker(guild: discord.Guild, attacker, action_str: str):
         print(f"[!] handle_attacker error: {e}")
 
 # ---------------- Security Panel UI ----------------
+# Whitelist edits use a modal (or a select for removals) instead of waiting
+# for a chat message, so nothing runs on the message path. Each flow's
+# context -- guild, panel message to refresh, mode -- lives in panel_flows
+# under the opening interaction's id until it is submitted or expires.
+PANEL_FLOW_TTL = 600
+panel_flows = {}  # flow id -> {"guild_id", "message", "mode", "expires"}
+
+def open_panel_flow(interaction: discord.Interaction, mode: str) -> int:
+    now = time.monotonic()
+    for fid in [f for f, st in panel_flows.items() if st["expires"] < now]:
+        del panel_flows[fid]
+    panel_flows[interaction.id] = {"guild_id": interaction.guild.id, "message": interaction.message,
+                                   "mode": mode, "expires": now + PANEL_FLOW_TTL}
+    return interaction.id
+
+def parse_user_ids(text: str):
+    ids = []
+    for part in text.replace(",", " ").split():
+        part = part.strip("<@!>")
+        if not part.isdigit():
+            raise ValueError(f"not a user ID: {part}")
+        ids.append(int(part))
+    return ids
+
+async def finish_panel_flow(interaction: discord.Interaction, flow: int, user_ids):
+    st = panel_flows.pop(flow, None)
+    if st is None or st["guild_id"] != interaction.guild.id:
+        return await interaction.response.send_message("This form has expired; use the panel button again.", ephemeral=True)
+    await interaction.response.defer(ephemeral=True)
+    add = st["mode"] == "add"
+    try:
+        apply_data_update(await run_blocking(edit_whitelist_guild, interaction.guild.id, user_ids, add))
+    except Exception as e:
+        return await interaction.followup.send(f"Error: {e}", ephemeral=True)
+    mentions = ", ".join(f"<@{uid}>" for uid in user_ids)
+    verb = "Added" if add else "Removed"
+    await interaction.followup.send(f"{verb} {mentions} {'to' if add else 'from'} whitelist for this server.", ephemeral=True)
+    if st["message"] is not None:
+        await SecurityPanel().update_embed_for_guild(interaction.guild, st["message"])
+
+class WhitelistModal(ui.Modal):
+    def __init__(self, flow: int, mode: str):
+        super().__init__(title="Add to whitelist" if mode == "add" else "Remove from whitelist", timeout=PANEL_FLOW_TTL)
+        self.flow = flow
+        self.user_ids = ui.TextInput(label="User ID(s)", placeholder="123456789012345678, <@987654321098765432>",
+                                     max_length=1000)
+        self.add_item(self.user_ids)
+
+    async def on_submit(self, interaction: discord.Interaction):
+        try:
+            ids = parse_user_ids(self.user_ids.value)
+        except ValueError as e:
+            panel_flows.pop(self.flow, None)
+            return await interaction.response.send_message(f"Error: {e}", ephemeral=True)
+        await finish_panel_flow(interaction, self.flow, ids)
+
+    async def on_timeout(self):
+        panel_flows.pop(self.flow, None)
+
+class WhitelistRemoveView(ui.View):
+    def __init__(self, flow: int, guild: discord.Guild, user_ids):
+        super().__init__(timeout=PANEL_FLOW_TTL)
+        self.flow = flow
+        options = []
+        for uid in user_ids:
+            m = guild.get_member(uid)
+            options.append(discord.SelectOption(label=f"{m.display_name if m else 'Unknown user'}"[:100], description=str(uid), value=str(uid)))
+        select = ui.Select(placeholder="Users to remove", min_values=1, max_values=len(options), options=options)
+        select.callback = self.on_select
+        self.select = select
+        self.add_item(select)
+
+    async def on_select(self, interaction: discord.Interaction):
+        await finish_panel_flow(interaction, self.flow, [int(v) for v in self.select.values])
+        self.stop()
+
+    async def on_timeout(self):
+        panel_flows.pop(self.flow, None)
+
 class SecurityPanel(ui.View):
     def __init__(self):
         super().__init__(timeout=None)
 
     async def update_embed_for_guild(self, guild: discord.Guild, message: discord.Message):
-        d = load_data()
-        status = (
-            f"Auto-Kick: {'ON' if d.get('auto_kick') else 'OFF'}\n"
-            f"Auto-Timeout: {'ON' if d.get('auto_timeout') else 'OFF'}\n"
-            f"Anti-ChannelCreate: {'ON' if d.get('anti_channel_create') else 'OFF'}\n"
-            f"Anti-ChannelDelete: {'ON' if d.get('anti_channel_delete') else 'OFF'}\n"
-            f"Anti-RoleCreate: {'ON' if d.get('anti_role_create') else 'OFF'}\n"
-            f"Anti-RoleDelete: {'ON' if d.get('anti_role_delete') else 'OFF'}\n"
-            f"Anti-RoleUpdate: {'ON' if d.get('anti_role_update') else 'OFF'}\n"
-            f"Anti-Webhook: {'ON' if d.get('anti_webhook') else 'OFF'}\n"
-            f"Anti-Rename: {'ON' if d.get('anti_raid') else 'OFF'}"
-        )
+        status = panel_status_text(get_policy(guild.id))
         lic_info = "No active license"
-        l = load_licenses()
+        l = licenses
         for k, v in l.get("keys", {}).items():
             if v.get("guild_id") == guild.id:
                 exp = v.get("expires_at")
@@ -480,129 +1767,211 @@ class SecurityPanel(ui.View):
         except Exception:
             pass
 
-    @ui.button(label="Add Whitelist (enter ID)", style=ButtonStyle.green)
+    @ui.button(label="Add Whitelist (enter ID)", style=ButtonStyle.green, custom_id="secpanel:wl_add")
     async def whitelist_add(self, interaction: discord.Interaction, button: ui.Button):
-        await interaction.response.send_message("Send the User ID to add to whitelist (this guild):", ephemeral=True)
-        def check(m): return m.author == interaction.user and m.channel == interaction.channel
-        try:
-            msg = await bot.wait_for("message", check=check, timeout=60)
-            uid = int(msg.content.strip())
-            add_whitelist_guild(interaction.guild.id, uid)
-            await interaction.followup.send(f"Added <@{uid}> to whitelist for this server.", ephemeral=True)
-            # refresh panel
-            await self.update_embed_for_guild(interaction.guild, interaction.message)
-        except asyncio.TimeoutError:
-            await interaction.followup.send("Timeout waiting for ID.", ephemeral=True)
-        except Exception as e:
-            await interaction.followup.send(f"Error: {e}", ephemeral=True)
+        flow = open_panel_flow(interaction, "add")
+        await interaction.response.send_modal(WhitelistModal(flow, "add"))
 
-    @ui.button(label="Remove Whitelist (enter ID)", style=ButtonStyle.red)
+    @ui.button(label="Remove Whitelist (enter ID)", style=ButtonStyle.red, custom_id="secpanel:wl_remove")
     async def whitelist_remove(self, interaction: discord.Interaction, button: ui.Button):
-        await interaction.response.send_message("Send the User ID to remove from whitelist (this guild):", ephemeral=True)
-        def check(m): return m.author == interaction.user and m.channel == interaction.channel
+        flow = open_panel_flow(interaction, "remove")
+        wl = sorted(get_whitelist_for_guild(interaction.guild.id))
+        if not wl:
+            panel_flows.pop(flow, None)
+            return await interaction.response.send_message("The whitelist for this server is empty.", ephemeral=True)
+        if len(wl) > 25:
+            # a select menu holds at most 25 options
+            return await interaction.response.send_modal(WhitelistModal(flow, "remove"))
+        await interaction.response.send_message("Select the users to remove from the whitelist (this guild):",
+                                                view=WhitelistRemoveView(flow, interaction.guild, wl), ephemeral=True)
+
+    async def toggle_setting(self, interaction: discord.Interaction, key: str, label: str, exclusive: str = None):
+        # flips one per-guild setting; `exclusive` is switched off when `key` turns on
         try:
-            msg = await bot.wait_for("message", check=check, timeout=60)
-            uid = int(msg.content.strip())
-            remove_whitelist_guild(interaction.guild.id, uid)
-            await interaction.followup.send(f"Removed <@{uid}> from whitelist for this server.", ephemeral=True)
-            await self.update_embed_for_guild(interaction.guild, interaction.message)
-        except asyncio.TimeoutError:
-            await interaction.followup.send("Timeout waiting for ID.", ephemeral=True)
-        except Exception as e:
-            await interaction.followup.send(f"Error: {e}", ephemeral=True)
+            await interaction.response.defer(ephemeral=True)
+        except Exception:
+            pass
+        p = get_policy(interaction.guild.id)
+        changes = {key: not getattr(p, key)}
+        if exclusive and changes[key]:
+            changes[exclusive] = False
+        apply_data_update(await run_blocking(update_guild_settings, interaction.guild.id, changes))
+        p = get_policy(interaction.guild.id)
+        await self.update_embed_for_guild(interaction.guild, interaction.message)
+        await interaction.followup.send(f"{label} set to {getattr(p, key)}", ephemeral=True)
 
-    @ui.button(label="Toggle Auto-Kick", style=ButtonStyle.gray)
+    @ui.button(label="Toggle Auto-Kick", style=ButtonStyle.gray, custom_id="secpanel:auto_kick")
     async def toggle_autokick(self, interaction: discord.Interaction, button: ui.Button):
-        d = load_data()
-        d["auto_kick"] = not d.get("auto_kick", True)
-        if d["auto_kick"]:
-            d["auto_timeout"] = False
-        save_data(d)
-        await self.update_embed_for_guild(interaction.guild, interaction.message)
-        await interaction.followup.send(f"Auto-Kick set to {d['auto_kick']}", ephemeral=True)
+        await self.toggle_setting(interaction, "auto_kick", "Auto-Kick", exclusive="auto_timeout")
 
-    @ui.button(label="Toggle Auto-Timeout", style=ButtonStyle.secondary)
+    @ui.button(label="Toggle Auto-Timeout", style=ButtonStyle.secondary, custom_id="secpanel:auto_timeout")
     async def toggle_autotimeout(self, interaction: discord.Interaction, button: ui.Button):
-        d = load_data()
-        d["auto_timeout"] = not d.get("auto_timeout", True)
-        if d["auto_timeout"]:
-            d["auto_kick"] = False
-        save_data(d)
-        await self.update_embed_for_guild(interaction.guild, interaction.message)
-        await interaction.followup.send(f"Auto-Timeout set to {d['auto_timeout']}", ephemeral=True)
+        await self.toggle_setting(interaction, "auto_timeout", "Auto-Timeout", exclusive="auto_kick")
 
-    @ui.button(label="Toggle Anti-ChannelCreate", style=ButtonStyle.blurple)
+    @ui.button(label="Toggle Anti-ChannelCreate", style=ButtonStyle.blurple, custom_id="secpanel:anti_channel_create")
     async def toggle_anti_channel_create(self, interaction: discord.Interaction, button: ui.Button):
-        d = load_data()
-        d["anti_channel_create"] = not d.get("anti_channel_create", True)
-        save_data(d)
-        await self.update_embed_for_guild(interaction.guild, interaction.message)
-        await interaction.followup.send(f"Anti-ChannelCreate set to {d['anti_channel_create']}", ephemeral=True)
+        await self.toggle_setting(interaction, "anti_channel_create", "Anti-ChannelCreate")
 
-    @ui.button(label="Toggle Anti-ChannelDelete", style=ButtonStyle.blurple)
-    async def toggle_anti_channel_create(self, interaction: discord.Interaction, button: ui.Button):
-        d = load_data()
-        d["anti_channel_delete"] = not d.get("anti_channel_delete", True)
-        save_data(d)
-        await self.update_embed_for_guild(interaction.guild, interaction.message)
-        await interaction.followup.send(f"Anti-ChannelDelete set to {d['anti_channel_delete']}", ephemeral=True)    
+    @ui.button(label="Toggle Anti-ChannelDelete", style=ButtonStyle.blurple, custom_id="secpanel:anti_channel_delete")
+    async def toggle_anti_channel_delete(self, interaction: discord.Interaction, button: ui.Button):
+        await self.toggle_setting(interaction, "anti_channel_delete", "Anti-ChannelDelete")
 
-    @ui.button(label="Toggle Anti-RoleCreate", style=ButtonStyle.gray)
+    @ui.button(label="Toggle Anti-RoleCreate", style=ButtonStyle.gray, custom_id="secpanel:anti_role_create")
     async def toggle_anti_role_create(self, interaction: discord.Interaction, button: ui.Button):
-        d = load_data()
-        d["anti_role_create"] = not d.get("anti_role_create", True)
-        save_data(d)
-        await self.update_embed_for_guild(interaction.guild, interaction.message)
-        await interaction.followup.send(f"Anti-RoleCreate set to {d['anti_role_create']}", ephemeral=True)
+        await self.toggle_setting(interaction, "anti_role_create", "Anti-RoleCreate")
 
-    @ui.button(label="Toggle Anti-RoleDelete", style=ButtonStyle.secondary)
+    @ui.button(label="Toggle Anti-RoleDelete", style=ButtonStyle.secondary, custom_id="secpanel:anti_role_delete")
     async def toggle_anti_role_delete(self, interaction: discord.Interaction, button: ui.Button):
-        d = load_data()
-        d["anti_role_delete"] = not d.get("anti_role_delete", True)
-        save_data(d)
-        await self.update_embed_for_guild(interaction.guild, interaction.message)
-        await interaction.followup.send(f"Anti-RoleDelete set to {d['anti_role_delete']}", ephemeral=True)
+        await self.toggle_setting(interaction, "anti_role_delete", "Anti-RoleDelete")
 
-    @ui.button(label="Toggle Anti-RoleUpdate", style=ButtonStyle.secondary)
+    @ui.button(label="Toggle Anti-RoleUpdate", style=ButtonStyle.secondary, custom_id="secpanel:anti_role_update")
     async def toggle_anti_role_update(self, interaction: discord.Interaction, button: ui.Button):
-        d = load_data()
-        d["anti_role_update"] = not d.get("anti_role_update", True)
-        save_data(d)
-        await self.update_embed_for_guild(interaction.guild, interaction.message)
-        await interaction.followup.send(f"Anti-RoleUpdate set to {d['anti_role_update']}", ephemeral=True)
+        await self.toggle_setting(interaction, "anti_role_update", "Anti-RoleUpdate")
 
-    @ui.button(label="Toggle Anti-Webhook", style=ButtonStyle.blurple)
+    @ui.button(label="Toggle Anti-Webhook", style=ButtonStyle.blurple, custom_id="secpanel:anti_webhook")
     async def toggle_anti_webhook(self, interaction: discord.Interaction, button: ui.Button):
-        d = load_data()
-        d["anti_webhook"] = not d.get("anti_webhook", True)
-        save_data(d)
-        await self.update_embed_for_guild(interaction.guild, interaction.message)
-        await interaction.followup.send(f"Anti-Webhook set to {d['anti_webhook']}", ephemeral=True)
+        await self.toggle_setting(interaction, "anti_webhook", "Anti-Webhook")
 
-    @ui.button(label="Refresh Panel", style=ButtonStyle.green)
+    @ui.button(label="Refresh Panel", style=ButtonStyle.green, custom_id="secpanel:refresh")
     async def refresh_panel(self, interaction: discord.Interaction, button: ui.Button):
-        await self.update_embed_for_guild(interaction.guild, interaction.message)
+        try:
+            await interaction.response.defer(ephemeral=True)
+        except Exception:
+            pass
+        await self.update_embed_for_guild(interaction.guild, interaction.message)
         await interaction.followup.send("Panel refreshed.", ephemeral=True)
 
 # ---------------- Verify button ----------------
+# Clicks are deferred at once and queued; VERIFY_WORKERS workers add the role
+# at a paced rate (VERIFY_INTERVAL seconds apart per worker) and send the
+# result as a followup, so a join wave neither times out interactions nor
+# floods the role route. A 429 is waited out inside discord.py's HTTP client,
+# which holds that worker until the bucket resets (the [rest] section of
+# !stats counts them). A member already queued is not
+# queued twice. Optional cheap risk checks hold new or avatar-less accounts.
+VERIFY_WORKERS = int(os.getenv("VERIFY_WORKERS", "2"))
+VERIFY_INTERVAL = float(os.getenv("VERIFY_INTERVAL", "0.25"))
+VERIFY_MIN_ACCOUNT_AGE_DAYS = float(os.getenv("VERIFY_MIN_ACCOUNT_AGE_DAYS", "0"))
+VERIFY_REQUIRE_AVATAR = os.getenv("VERIFY_REQUIRE_AVATAR", "0") == "1"
+
+verify_queue = asyncio.Queue()
+verify_pending = set()  # (guild_id, member_id) queued or in progress
+verify_workers = []
+verify_stats = {"queued": 0, "granted": 0, "held": 0, "failed": 0, "deduped": 0}
+
+def verify_risk(member: discord.Member):
+    # reason to hold the member back, or None
+    if VERIFY_MIN_ACCOUNT_AGE_DAYS > 0:
+        age = datetime.now(timezone.utc) - member.created_at
+        if age < timedelta(days=VERIFY_MIN_ACCOUNT_AGE_DAYS):
+            return f"account is {age.days}d old (minimum {VERIFY_MIN_ACCOUNT_AGE_DAYS:g}d)"
+    if VERIFY_REQUIRE_AVATAR and member.avatar is None:
+        return "account has no avatar"
+    return None
+
+async def verify_followup(interaction: discord.Interaction, text: str):
+    try:
+        await interaction.followup.send(text, ephemeral=True)
+    except Exception:
+        pass
+
+async def verify_worker():
+    while True:
+        interaction, member, role = await verify_queue.get()
+        key = (member.guild.id, member.id)
+        try:
+            await member.add_roles(role, reason="Verified")
+            verify_stats["granted"] += 1
+            await verify_followup(interaction, "You have been verified!")
+        except Exception:
+            verify_stats["failed"] += 1
+            await verify_followup(interaction, "Failed to add role (missing perms).")
+        finally:
+            verify_pending.discard(key)
+            verify_queue.task_done()
+        await asyncio.sleep(VERIFY_INTERVAL)
+
+def start_verify_workers():
+    while len(verify_workers) < max(1, VERIFY_WORKERS):
+        verify_workers.append(asyncio.create_task(verify_worker()))
+
+def verify_report():
+    return (
+        f"[verify] queue {verify_queue.qsize()} | queued {verify_stats['queued']} | granted {verify_stats['granted']} | "
+        f"held {verify_stats['held']} | failed {verify_stats['failed']} | deduped {verify_stats['deduped']}"
+    )
+
 class VerifyButton(ui.View):
-    def __init__(self, verify_role):
+    def __init__(self, verify_role=None):
         super().__init__(timeout=None)
         self.verify_role = verify_role
 
-    @ui.button(label="Verify", style=ButtonStyle.gray)
+    @ui.button(label="Verify", style=ButtonStyle.gray, custom_id="verify:button")
     async def verify(self, interaction: discord.Interaction, button: ui.Button):
         member = interaction.user
-        try:
-            if self.verify_role not in member.roles:
-                await member.add_roles(self.verify_role, reason="Verified")
-                await interaction.response.send_message("You have been verified!", ephemeral=True)
-            else:
-                await interaction.response.send_message("You are already verified.", ephemeral=True)
-        except Exception:
-            await interaction.response.send_message("Failed to add role (missing perms).", ephemeral=True)
+        # the persistent instance registered at startup has no role; resolve per guild
+        role = self.verify_role
+        if role is None or role.guild.id != interaction.guild.id:
+            role = await ensure_role(interaction.guild, data.get("verify_role_name", "$verified"))
+        if role is None:
+            return await interaction.response.send_message("Failed to add role (missing perms).", ephemeral=True)
+        if role in member.roles:
+            return await interaction.response.send_message("You are already verified.", ephemeral=True)
+        key = (interaction.guild.id, member.id)
+        if key in verify_pending:
+            verify_stats["deduped"] += 1
+            return await interaction.response.send_message("You are already in the verification queue.", ephemeral=True)
+        reason = verify_risk(member)
+        if reason:
+            verify_stats["held"] += 1
+            record_incident(interaction.guild, member.id, f"Verification held: {reason}", "VERIFY HELD")
+            return await interaction.response.send_message("Verification is on hold for your account; please contact a moderator.", ephemeral=True)
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        verify_pending.add(key)
+        verify_stats["queued"] += 1
+        verify_queue.put_nowait((interaction, member, role))
+        start_verify_workers()
 
 # ---------------- Key management / master commands ----------------
+# Revocation and expiry queue a teardown (deleting the panel, logs and shame
+# channels) in the licenses doc instead of doing it inline: in cluster mode the
+# worker that handles the command or wins the expiry update usually does not
+# serve the guild. Every worker claims the entries for guilds it serves, from
+# the command itself and from expire_check; entries no worker claims (the bot
+# left the guild) are dropped after TEARDOWN_MAX_AGE_DAYS.
+TEARDOWN_MAX_AGE_DAYS = 7
+
+def queue_teardown(l: dict, guild_id: int, reason: str):
+    # called inside a licenses update
+    l.setdefault("pending_teardown", []).append({"guild_id": int(guild_id), "reason": reason, "ts": time.time()})
+
+async def teardown_guild_channels(guild: discord.Guild, reason: str):
+    for ch_name in (data.get("panel_channel_name", "security-panel"), data.get("logs_channel_name", "security-logs"), data.get("shame_channel_name", "shame")):
+        ch = discord.utils.get(guild.channels, name=ch_name)
+        if ch:
+            try:
+                await ch.delete(reason=reason)
+            except Exception:
+                pass
+
+async def run_pending_teardowns():
+    cutoff = time.time() - TEARDOWN_MAX_AGE_DAYS * 86400
+    served = {g.id for g in bot.guilds}  # read on the loop, not in the storage thread
+    def claim(l):
+        pending = l.get("pending_teardown")
+        if not pending:
+            return []
+        mine = [e for e in pending if int(e["guild_id"]) in served]
+        rest = [e for e in pending if e not in mine and e.get("ts", 0) > cutoff]
+        if rest:
+            l["pending_teardown"] = rest
+        else:
+            l.pop("pending_teardown", None)
+        return mine
+    for e in await aupdate_licenses(claim):
+        g = bot.get_guild(int(e["guild_id"]))
+        if g:
+            await teardown_guild_channels(g, e["reason"])
 @bot.command(name="genkey")
 async def genkey(ctx: commands.Context, duration: str):
     if ctx.author.id != MASTER_OWNER_ID:
@@ -610,19 +1979,18 @@ async def genkey(ctx: commands.Context, duration: str):
     if duration not in ("7d", "30d", "permanent"):
         return await ctx.send("Invalid duration. Use 7d, 30d, or permanent.", delete_after=8)
     key = generate_key(32)
-    l = load_licenses()
-    l.setdefault("keys", {})
     issued = now_iso()
     expires = make_expiry(duration)
-    l["keys"][key] = {
-        "duration": duration,
-        "issued_at": issued,
-        "expires_at": expires,
-        "used": False,
-        "user_id": None,
-        "guild_id": None
-    }
-    save_licenses(l)
+    def add_key(l):
+        l.setdefault("keys", {})[key] = {
+            "duration": duration,
+            "issued_at": issued,
+            "expires_at": expires,
+            "used": False,
+            "user_id": None,
+            "guild_id": None
+        }
+    await aupdate_licenses(add_key)
     try:
         await ctx.author.send(f"```Generated key: {key}\nDuration: {duration}\nExpires: {expires}```")
     except Exception:
@@ -634,23 +2002,14 @@ async def genkey(ctx: commands.Context, duration: str):
 async def revoke(ctx: commands.Context, key: str):
     if ctx.author.id != MASTER_OWNER_ID:
         return await ctx.send("Only the master owner can revoke keys.", delete_after=8)
-    l = load_licenses()
-    if key in l.get("keys", {}):
-        rec = l["keys"][key]
-        guild_id = rec.get("guild_id")
-        del l["keys"][key]
-        save_licenses(l)
-        if guild_id:
-            g = bot.get_guild(int(guild_id))
-            if g:
-                d = load_data()
-                for ch_name in (d.get("panel_channel_name", "security-panel"), d.get("logs_channel_name", "security-logs"), d.get("shame_channel_name", "shame")):
-                    ch = discord.utils.get(g.channels, name=ch_name)
-                    if ch:
-                        try:
-                            await ch.delete(reason=f"Key {key} revoked by master owner")
-                        except Exception:
-                            pass
+    def drop_key(l):
+        rec = l.get("keys", {}).pop(key, None)
+        if rec and rec.get("guild_id"):
+            queue_teardown(l, rec["guild_id"], f"Key {key} revoked by master owner")
+        return rec
+    rec = await aupdate_licenses(drop_key)
+    if rec is not None:
+        await run_pending_teardowns()
         await ctx.send("Key revoked.")
         await post_webhook(f"Key revoked by master owner: {key}")
     else:
@@ -660,26 +2019,16 @@ async def revoke(ctx: commands.Context, key: str):
 async def revokekey(ctx: commands.Context, userid: int):
     if ctx.author.id != MASTER_OWNER_ID:
         return await ctx.send("Only the master owner can revoke keys.", delete_after=8)
-    l = load_licenses()
-    changed = False
-    for k, v in list(l.get("keys", {}).items()):
-        if v.get("user_id") == userid:
-            guild_id = v.get("guild_id")
-            del l["keys"][k]
-            changed = True
-            if guild_id:
-                g = bot.get_guild(int(guild_id))
-                if g:
-                    d = load_data()
-                    for ch_name in (d.get("panel_channel_name", "security-panel"), d.get("logs_channel_name", "security-logs"), d.get("shame_channel_name", "shame")):
-                        ch = discord.utils.get(g.channels, name=ch_name)
-                        if ch:
-                            try:
-                                await ch.delete(reason=f"Key revoked for user {userid}")
-                            except Exception:
-                                pass
-    if changed:
-        save_licenses(l)
+    def drop_user_keys(l):
+        keys = l.get("keys", {})
+        dropped = [keys.pop(k) for k, v in list(keys.items()) if v.get("user_id") == userid]
+        for v in dropped:
+            if v.get("guild_id"):
+                queue_teardown(l, v["guild_id"], f"Key revoked for user {userid}")
+        return dropped
+    dropped = await aupdate_licenses(drop_user_keys)
+    if dropped:
+        await run_pending_teardowns()
         await ctx.send("Revoked keys for that user and removed their server channels (if the bot is in that server).")
         await post_webhook(f"Keys revoked for user {userid} by master owner.")
     else:
@@ -689,7 +2038,7 @@ async def revokekey(ctx: commands.Context, userid: int):
 async def listkeys(ctx: commands.Context):
     if ctx.author.id != MASTER_OWNER_ID:
         return await ctx.send("Only the master owner can list keys.", delete_after=8)
-    l = load_licenses()
+    l = licenses
     lines = ["Key -> user_id -> guild_id -> expires_at -> used"]
     for k, v in l.get("keys", {}).items():
         lines.append(f"{k} -> {v.get('user_id')} -> {v.get('guild_id')} -> {v.get('expires_at')} -> {v.get('used')}")
@@ -699,6 +2048,18 @@ async def listkeys(ctx: commands.Context):
         pass
     await ctx.send("Sent key list to master owner via DM.")
 
+@bot.command(name="runtime")
+async def runtime(ctx: commands.Context):
+    if ctx.author.id != MASTER_OWNER_ID:
+        return await ctx.send("Only the master owner can view runtime stats.", delete_after=8)
+    await ctx.send(shell_block(runtime_report()))
+
+@bot.command(name="shards")
+async def shards(ctx: commands.Context):
+    if ctx.author.id != MASTER_OWNER_ID:
+        return await ctx.send("Only the master owner can view shard stats.", delete_after=8)
+    await ctx.send(shell_block(shard_report()))
+
 # ---------------- Buyer commands ----------------
 @bot.command(name="login")
 async def login(ctx: commands.Context, key: str):
@@ -712,18 +2073,24 @@ async def login(ctx: commands.Context, key: str):
     if not ok:
         return await ctx.send(f"Key invalid: {reason}", delete_after=12)
 
-    l = load_licenses()
-    rec = l["keys"].get(key)
-    if not rec:
-        return await ctx.send("Key not found (race).", delete_after=8)
-
-    rec["used"] = True
-    rec["user_id"] = ctx.author.id
-    rec["guild_id"] = guild.id
-    l["keys"][key] = rec
-    save_licenses(l)
+    def claim(l):
+        # re-checked inside the update so two logins cannot claim one key
+        ok, reason = key_is_valid_and_avail(key, l)
+        if not ok:
+            return None, reason
+        rec = l["keys"][key]
+        rec["used"] = True
+        rec["user_id"] = ctx.author.id
+        rec["guild_id"] = guild.id
+        return rec, None
+    rec, reason = await aupdate_licenses(claim)
+    if rec is None:
+        return await ctx.send(f"Key invalid: {reason}", delete_after=12)
 
     await ctx.send("License activated for this server. Panel and anti features are enabled.")
+    if ctx.guild:
+        await provision_guilds([ctx.guild])
+        await audit_catchup([ctx.guild])
     await post_webhook(f"Key used: {key} | guild: {guild.id} | user: {ctx.author.id} | expires: {rec.get('expires_at')}")
 
 @bot.command(name="logout")
@@ -734,17 +2101,16 @@ async def logout(ctx: commands.Context):
     if ctx.author.id != guild.owner_id:
         return await ctx.send("Only the server owner can use this command.", delete_after=8)
 
-    l = load_licenses()
-    changed = False
-    for k, v in list(l.get("keys", {}).items()):
-        if v.get("guild_id") == guild.id:
-            v["guild_id"] = None
-            v["user_id"] = None
-            v["used"] = False
-            l["keys"][k] = v
-            changed = True
-    if changed:
-        save_licenses(l)
+    def unbind(l):
+        changed = False
+        for v in l.get("keys", {}).values():
+            if v.get("guild_id") == guild.id:
+                v["guild_id"] = None
+                v["user_id"] = None
+                v["used"] = False
+                changed = True
+        return changed
+    if await aupdate_licenses(unbind):
         await ctx.send("License removed from this server. Bot features are now disabled until reactivation.")
         await post_webhook(f"License removed for guild {guild.id} by owner {ctx.author.id}")
     else:
@@ -755,7 +2121,7 @@ async def license_info(ctx: commands.Context):
     guild = ctx.guild or await find_guild()
     if not guild:
         return await ctx.send("This command must be used in a guild.")
-    l = load_licenses()
+    l = licenses
     for k, v in l.get("keys", {}).items():
         if v.get("guild_id") == guild.id:
             lines = [
@@ -781,7 +2147,7 @@ async def addpanel(ctx: commands.Context):
         if not license_valid_for_guild(guild.id):
             return await ctx.send("Your server is not licensed or license expired. Activate with !login <key>.", delete_after=12)
 
-    d = load_data()
+    d = data
     panel_name = d.get("panel_channel_name", "security-panel")
     logs_name = d.get("logs_channel_name", "security-logs")
     shame_ch = await ensure_shame_channel(guild)
@@ -835,18 +2201,7 @@ async def addpanel(ctx: commands.Context):
             pass
 
     view = SecurityPanel()
-    d = load_data()
-    status = (
-        f"Auto-Kick: {'ON' if d.get('auto_kick') else 'OFF'}\n"
-        f"Auto-Timeout: {'ON' if d.get('auto_timeout') else 'OFF'}\n"
-        f"Anti-ChannelCreate: {'ON' if d.get('anti_channel_create') else 'OFF'}\n"
-        f"Anti-ChannelDelete: {'ON' if d.get('anti_channel_delete') else 'OFF'}\n"
-        f"Anti-RoleCreate: {'ON' if d.get('anti_role_create') else 'OFF'}\n"
-        f"Anti-RoleDelete: {'ON' if d.get('anti_role_delete') else 'OFF'}\n"
-        f"Anti-RoleUpdate: {'ON' if d.get('anti_role_update') else 'OFF'}\n"
-        f"Anti-Webhook: {'ON' if d.get('anti_webhook') else 'OFF'}\n"
-        f"Anti-Rename: {'ON' if d.get('anti_raid') else 'OFF'}"
-    )
+    status = panel_status_text(get_policy(guild.id))
     embed = discord.Embed(
         title="SECURITY CONTROL PANEL",
         description=f"Use the buttons below to manage whitelist and toggles.\n\n{status}",
@@ -856,8 +2211,9 @@ async def addpanel(ctx: commands.Context):
 
     # save panel message id for live updates
     panel_message_map[guild.id] = sent.id
-    d.setdefault("panel_messages", {})[str(guild.id)] = sent.id
-    save_data(d)
+    def note_panel(d):
+        d.setdefault("panel_messages", {})[str(guild.id)] = sent.id
+    await aupdate_data(note_panel)
 
     if verify_ch:
         try:
@@ -877,18 +2233,102 @@ async def addpanel(ctx: commands.Context):
 
     await ctx.send(f"Security panel created in {panel.mention}")
 
+# ---------------- Dangerous permission scanner ----------------
+# Role permissions are compared as raw integers against one precomputed mask,
+# so a role check is a couple of AND operations. Role updates are only acted
+# on when a dangerous bit is gained, and only those bits are reverted; the
+# periodic audit walks every role of every licensed guild in one pass and
+# reports roles that picked up dangerous bits without an event.
+DANGEROUS_PERMISSIONS = discord.Permissions(
+    administrator=True, ban_members=True, kick_members=True, manage_roles=True,
+    manage_channels=True, manage_webhooks=True, manage_guild=True,
+).value
+ROLE_AUDIT_MINUTES = float(os.getenv("ROLE_AUDIT_MINUTES", "15"))
+
+dangerous_role_masks = {}  # guild_id -> {role_id: dangerous bits held at the last check}
+role_audit_stats = {"runs": 0, "roles": 0, "flagged": 0, "last_ms": 0.0}
+
+def dangerous_gain(before_value: int, after_value: int) -> int:
+    return after_value & ~before_value & DANGEROUS_PERMISSIONS
+
+def permission_names(bits: int):
+    return [name for name, on in discord.Permissions(bits) if on]
+
+def note_role_mask(guild_id: int, role_id: int, value: int):
+    masks = dangerous_role_masks.get(guild_id)
+    if masks is not None:
+        masks[role_id] = value & DANGEROUS_PERMISSIONS
+
+def scan_guild_roles(guild: discord.Guild):
+    # one pass over the role cache: [(role, newly held dangerous bits)]
+    masks = dangerous_role_masks.get(guild.id)
+    seeding = masks is None
+    if seeding:
+        masks = dangerous_role_masks[guild.id] = {}
+    live, flagged = {}, []
+    for role in guild.roles:
+        bits = role.permissions.value & DANGEROUS_PERMISSIONS
+        live[role.id] = bits
+        if bits and not seeding and not role.managed:
+            new = bits & ~masks.get(role.id, 0)
+            if new:
+                flagged.append((role, new))
+    dangerous_role_masks[guild.id] = live
+    return flagged
+
+@bot.listen("on_guild_role_create")
+async def dangerous_role_create(role):
+    note_role_mask(role.guild.id, role.id, role.permissions.value)
+
+@tasks.loop(minutes=ROLE_AUDIT_MINUTES)
+async def role_permission_audit():
+    if overload.shedding:
+        overload.drop("role_audit")
+        return
+    licensed = licensed_guild_ids()
+    start = time.perf_counter()
+    roles, findings = 0, []
+    for g in bot.guilds:
+        if g.id not in licensed or not shard_is_ready(g):
+            continue
+        roles += len(g.roles)
+        flagged = scan_guild_roles(g)
+        if flagged:
+            findings.append((g, flagged))
+    role_audit_stats["runs"] += 1
+    role_audit_stats["roles"] = roles
+    role_audit_stats["last_ms"] = (time.perf_counter() - start) * 1000
+    metrics.observe("bot_role_audit_seconds", time.perf_counter() - start)
+    for g, flagged in findings:
+        role_audit_stats["flagged"] += len(flagged)
+        metrics.inc("bot_role_audit_flagged_total", value=len(flagged))
+        lines = ["[SYSTEM: DANGEROUS ROLE PERMISSIONS]", "──────────────────────────────────────"]
+        for role, bits in flagged[:15]:
+            lines.append(f"@{role.name} ({role.id}) gained: {', '.join(permission_names(bits))}")
+            record_incident(g, None, f"Role @{role.name} gained {', '.join(permission_names(bits))}", "DANGEROUS ROLE")
+        lines += ["──────────────────────────────────────", "No role update event was seen for these; review the audit log."]
+        await send_alert(g, shell_block(lines), include_shame=False)
+
+def role_audit_report():
+    return (
+        f"[roles] {role_audit_stats['runs']} audits | {role_audit_stats['roles']} roles last pass in "
+        f"{role_audit_stats['last_ms']:.1f}ms | {role_audit_stats['flagged']} flagged"
+    )
+
 # ---------------- Anti events ----------------
 @bot.event
+@instrumented
 async def on_guild_channel_update(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
-    d = load_data()
-    if not d.get("anti_raid", True):
-        return
     guild = after.guild
+    note_shard_event(guild)
+    if not get_policy(guild.id).anti_raid:
+        return
     if not license_valid_for_guild(guild.id):
         return
     try:
         async for entry in guild.audit_logs(limit=1, action=discord.AuditLogAction.channel_update):
             actor = entry.user
+            note_audit_cursor(guild.id, entry.id)
             break
         else:
             return
@@ -898,7 +2338,7 @@ async def on_guild_channel_update(before: discord.abc.GuildChannel, after: disco
         return
     if before.name != after.name:
         now = asyncio.get_event_loop().time()
-        q = recent_renames[actor.id]
+        q = recent_renames[(guild.id, actor.id)]
         q.append(now)
         while q and now - q[0] > 30:
             q.popleft()
@@ -910,47 +2350,87 @@ async def on_guild_channel_update(before: discord.abc.GuildChannel, after: disco
             await log_shame_and_record(guild, actor, "Mass Channel Rename Detected", status="REVERTED")
             await fast_punish(guild, actor, "Mass Channel Rename Detected")
 
+# known-good webhooks per guild: webhook_id -> channel_id. Filled during
+# provisioning and by whitelisted creators; on_webhooks_update only deletes
+# webhooks missing from it. Updates for a channel that is already being
+# checked are coalesced into one re-check after the current one finishes.
+known_webhooks = defaultdict(dict)
+webhook_checks_inflight = set()
+webhook_checks_pending = set()
+
+async def register_guild_webhooks(guild: discord.Guild):
+    if not guild.me.guild_permissions.manage_webhooks:
+        return
+    known_webhooks[guild.id] = {wh.id: wh.channel_id for wh in await guild.webhooks()}
+
+async def check_channel_webhooks(channel):
+    guild = channel.guild
+    hooks = await channel.webhooks()
+    known = known_webhooks[guild.id]
+    live = {wh.id for wh in hooks}
+    for wid in [w for w, cid in known.items() if cid == channel.id and w not in live]:
+        del known[wid]
+    unknown = [wh for wh in hooks if wh.id not in known and getattr(wh.user, "id", None) != bot.user.id]
+    if not unknown:
+        return
+    # each webhook carries its creator, so no audit-log lookup is needed and
+    # concurrent creators are not blamed for each other's webhooks; webhooks
+    # without one (e.g. channel follows) are left alone
+    by_creator = defaultdict(list)
+    for wh in unknown:
+        if wh.user is not None:
+            by_creator[wh.user.id].append(wh)
+    for hooks_by in by_creator.values():
+        actor = hooks_by[0].user
+        if is_whitelisted(guild.id, actor.id) or actor.bot:
+            for wh in hooks_by:
+                known[wh.id] = wh.channel_id
+            continue
+        results = await asyncio.gather(*(wh.delete(reason="Anti-Webhook: unauthorized") for wh in hooks_by), return_exceptions=True)
+        failed = sum(1 for r in results if isinstance(r, Exception))
+        status = "DELETED" if not failed else f"DELETED {len(hooks_by) - failed}/{len(hooks_by)}"
+        await log_shame_and_record(guild, actor, "Unauthorized Webhook Creation", status=status)
+        await fast_punish(guild, actor, "Unauthorized Webhook Creation")
+
 @bot.event
+@instrumented
 async def on_webhooks_update(channel):
-    d = load_data()
-    if not d.get("anti_webhook", True):
-        return
     guild = channel.guild
-    if not license_valid_for_guild(guild.id):
+    note_shard_event(guild)
+    if not get_policy(guild.id).anti_webhook:
         return
-    try:
-        async for entry in guild.audit_logs(limit=1, action=discord.AuditLogAction.webhook_create):
-            actor = entry.user
-            break
-        else:
-            return
-    except Exception:
+    if not license_valid_for_guild(guild.id):
         return
-    if is_whitelisted(guild.id, actor.id) or actor.bot:
+    if channel.id in webhook_checks_inflight:
+        webhook_checks_pending.add(channel.id)
+        metrics.inc("bot_webhook_updates_coalesced_total")
         return
+    webhook_checks_inflight.add(channel.id)
     try:
-        hooks = await channel.webhooks()
-        for wh in hooks:
+        while True:
+            webhook_checks_pending.discard(channel.id)
             try:
-                await wh.delete(reason="Anti-Webhook: unauthorized")
-            except Exception:
-                pass
-        await log_shame_and_record(guild, actor, "Unauthorized Webhook Creation", status="DELETED")
-        await fast_punish(guild, actor, "Unauthorized Webhook Creation")
-    except Exception:
-        await log_shame_and_record(guild, actor, "Unauthorized Webhook Creation", status="ERROR")
+                await check_channel_webhooks(channel)
+            except Exception as e:
+                print(f"[!] webhook check failed for channel {channel.id}: {e}")
+            if channel.id not in webhook_checks_pending:
+                break
+    finally:
+        webhook_checks_inflight.discard(channel.id)
 
 @bot.event
+@instrumented
 async def on_guild_channel_create(channel):
-    d = load_data()
-    if not d.get("anti_channel_create", True):
-        return
     guild = channel.guild
+    note_shard_event(guild)
+    if not get_policy(guild.id).anti_channel_create:
+        return
     if not license_valid_for_guild(guild.id):
         return
     try:
         async for entry in guild.audit_logs(limit=1, action=discord.AuditLogAction.channel_create):
             actor = entry.user
+            note_audit_cursor(guild.id, entry.id)
             break
         else:
             return
@@ -966,16 +2446,18 @@ async def on_guild_channel_create(channel):
     await fast_punish(guild, actor, "Unauthorized Channel Creation")
 
 @bot.event
+@instrumented
 async def on_guild_channel_delete(channel):
-    d = load_data()
-    if not d.get("anti_channel_delete", True):
-        return
     guild = channel.guild
+    note_shard_event(guild)
+    if not get_policy(guild.id).anti_channel_delete:
+        return
     if not license_valid_for_guild(guild.id):
         return
     try:
         async for entry in guild.audit_logs(limit=1, action=discord.AuditLogAction.channel_delete):
             actor = entry.user
+            note_audit_cursor(guild.id, entry.id)
             break
         else:
             return
@@ -991,16 +2473,18 @@ async def on_guild_channel_delete(channel):
     await fast_punish(guild, actor, "Unauthorized Channel Delete")    
 
 @bot.event
+@instrumented
 async def on_guild_role_create(role):
-    d = load_data()
-    if not d.get("anti_role_create", True):
-        return
     guild = role.guild
+    note_shard_event(guild)
+    if not get_policy(guild.id).anti_role_create:
+        return
     if not license_valid_for_guild(guild.id):
         return
     try:
         async for entry in guild.audit_logs(limit=1, action=discord.AuditLogAction.role_create):
             actor = entry.user
+            note_audit_cursor(guild.id, entry.id)
             break
         else:
             return
@@ -1016,16 +2500,18 @@ async def on_guild_role_create(role):
     await fast_punish(guild, actor, "Unauthorized Role Creation")
 
 @bot.event
+@instrumented
 async def on_guild_role_delete(role):
-    d = load_data()
-    if not d.get("anti_role_delete", True):
-        return
     guild = role.guild
+    note_shard_event(guild)
+    if not get_policy(guild.id).anti_role_delete:
+        return
     if not license_valid_for_guild(guild.id):
         return
     try:
         async for entry in guild.audit_logs(limit=1, action=discord.AuditLogAction.role_delete):
             actor = entry.user
+            note_audit_cursor(guild.id, entry.id)
             break
         else:
             return
@@ -1037,16 +2523,22 @@ async def on_guild_role_delete(role):
     await fast_punish(guild, actor, "Unauthorized Role Deletion")
 
 @bot.event
+@instrumented
 async def on_guild_role_update(before: discord.Role, after: discord.Role):
-    d = load_data()
-    if not d.get("anti_role_update", True):
-        return
     guild = after.guild
+    note_shard_event(guild)
+    note_role_mask(guild.id, after.id, after.permissions.value)
+    if not get_policy(guild.id).anti_role_update:
+        return
+    gained = dangerous_gain(before.permissions.value, after.permissions.value)
+    if not gained:
+        return
     if not license_valid_for_guild(guild.id):
         return
     try:
         async for entry in guild.audit_logs(limit=1, action=discord.AuditLogAction.role_update):
             actor = entry.user
+            note_audit_cursor(guild.id, entry.id)
             break
         else:
             return
@@ -1054,22 +2546,24 @@ async def on_guild_role_update(before: discord.Role, after: discord.Role):
         return
     if is_whitelisted(guild.id, actor.id) or actor.bot:
         return
-    perm_changed = before.permissions != after.permissions
-    name_changed = before.name != after.name
-    if perm_changed or name_changed:
-        try:
-            await after.edit(name=before.name, permissions=before.permissions, reason="Anti-Raid: revert role update")
-        except Exception:
-            pass
-        await log_shame_and_record(guild, actor, "Unauthorized Role Update", status="REVERTED")
-        await fast_punish(guild, actor, "Unauthorized Role Update")
+    # strip only the dangerous bits that were added; other edits stay
+    reverted = after.permissions.value & ~gained
+    try:
+        await after.edit(permissions=discord.Permissions(reverted), reason="Anti-Raid: revert dangerous permissions")
+        note_role_mask(guild.id, after.id, reverted)
+    except Exception:
+        pass
+    action = f"Unauthorized Role Update ({', '.join(permission_names(gained))})"
+    await log_shame_and_record(guild, actor, action, status="REVERTED")
+    await fast_punish(guild, actor, action)
 
 @bot.event
+@instrumented
 async def on_guild_update(before: discord.Guild, after: discord.Guild):
-    d = load_data()
-    if not d.get("anti_raid", True):
-        return
     guild = after
+    note_shard_event(guild)
+    if not get_policy(guild.id).anti_raid:
+        return
     if not license_valid_for_guild(guild.id):
         return
     try:
@@ -1082,6 +2576,7 @@ async def on_guild_update(before: discord.Guild, after: discord.Guild):
     try:
         async for entry in guild.audit_logs(limit=1, action=discord.AuditLogAction.guild_update):
             actor = entry.user
+            note_audit_cursor(guild.id, entry.id)
             break
         else:
             return
@@ -1092,83 +2587,800 @@ async def on_guild_update(before: discord.Guild, after: discord.Guild):
     await log_shame_and_record(guild, actor, "Vanity URL Change Detected", status="DETECTED")
     await fast_punish(guild, actor, "Vanity URL Change Detected")
 
+@bot.event
+@instrumented
+async def on_member_join(member: discord.Member):
+    guild = member.guild
+    note_shard_event(guild)
+    threat_stats["joins_checked"] += 1
+    if member.bot:
+        return
+    entry = known_threat(member.id)
+    if entry is None:
+        return
+    p = get_policy(guild.id)
+    if not p.anti_nuke:
+        return
+    if not license_valid_for_guild(guild.id):
+        return
+    if is_whitelisted(guild.id, member.id):
+        return
+    origin = "this server" if entry[1] == guild.id else f"server {entry[1]}"
+    action_str = f"Known attacker joined (punished in {origin} for {entry[2]})"
+    me = guild.me
+    try:
+        if p.auto_ban and me.guild_permissions.ban_members:
+            await member.ban(reason=f"Threat list: {entry[2]}"[:500], delete_message_seconds=0)
+            status = "BANNED ON JOIN"
+        elif me.guild_permissions.moderate_members:
+            await timeout_member(member, p.rate_limit_hours, reason=f"Threat list: {entry[2]}"[:500])
+            status = "HELD ON JOIN"
+        elif me.guild_permissions.kick_members:
+            await member.kick(reason=f"Threat list: {entry[2]}"[:500])
+            status = "KICKED ON JOIN"
+        else:
+            status = "MISSING PERM"
+    except Exception as e:
+        print(f"[!] threat list join action failed: {e}")
+        status = "FAILED"
+    threat_stats["blocked"] += status.endswith("ON JOIN")
+    metrics.inc("bot_threat_join_hits_total", (("status", status),))
+    await log_shame_and_record(guild, member, action_str, status=status)
+
+# ---------------- Audit-log catch-up ----------------
+# Detection is event driven, so anything done while the gateway session was
+# lost (bot offline, or a reconnect that could not resume) is never seen. For
+# every licensed guild the id of the newest audit entry seen is kept, advanced
+# live by on_audit_log_entry_create, and flushed to the "cursors" store
+# document; on every ready, the entries after that cursor are paged
+# oldest-first (100 per request) and run through the same delete/revert + log
+# + fast_punish steps as the live handlers. Guilds without a license keep no
+# cursor, so nothing from before a license is ever replayed.
+AUDIT_CATCHUP_MAX = int(os.getenv("AUDIT_CATCHUP_MAX", "500"))
+AUDIT_CATCHUP_CONCURRENCY = int(os.getenv("AUDIT_CATCHUP_CONCURRENCY", "4"))
+
+audit_cursors = {}
+audit_cursors_dirty = False
+audit_cursors_forgotten = set()
+
+def note_audit_cursor(guild_id: int, entry_id: int):
+    global audit_cursors_dirty
+    if entry_id > audit_cursors.get(guild_id, 0):
+        audit_cursors[guild_id] = entry_id
+        audit_cursors_dirty = True
+
+def load_audit_cursors():
+    doc = store.get("cursors")
+    for k, v in doc.get("audit", {}).items():
+        audit_cursors[int(k)] = max(int(v), audit_cursors.get(int(k), 0))
+
+def forget_audit_cursor(guild_id: int):
+    global audit_cursors_dirty
+    if audit_cursors.pop(guild_id, None) is not None:
+        audit_cursors_forgotten.add(guild_id)
+        audit_cursors_dirty = True
+
+def save_audit_cursors(snapshot: dict, forget=()):
+    def merge(doc):
+        merged = doc.setdefault("audit", {})
+        for gid in forget:
+            merged.pop(str(gid), None)
+        for gid, eid in snapshot.items():
+            if eid > int(merged.get(str(gid), 0)):
+                merged[str(gid)] = eid
+    store.update("cursors", merge)
+
+load_audit_cursors()
+
+@tasks.loop(seconds=30)
+async def audit_cursor_flush():
+    global audit_cursors_dirty
+    if not audit_cursors_dirty:
+        return
+    audit_cursors_dirty = False
+    forget = set(audit_cursors_forgotten)
+    audit_cursors_forgotten.clear()
+    try:
+        await run_blocking(save_audit_cursors, dict(audit_cursors), forget)
+    except Exception as e:
+        audit_cursors_forgotten.update(forget)
+        audit_cursors_dirty = True
+        print(f"[!] audit cursor flush failed: {e}")
+
+@bot.listen("on_audit_log_entry_create")
+async def audit_cursor_follow(entry: discord.AuditLogEntry):
+    # keeps the cursor at the live edge, so catch-up only covers real gaps
+    if entry.guild.id in audit_cursors:
+        note_audit_cursor(entry.guild.id, entry.id)
+
+# action -> (policy toggle, label used in logs)
+CATCHUP_ACTIONS = {
+    discord.AuditLogAction.channel_create: ("anti_channel_create", "Unauthorized Channel Creation"),
+    discord.AuditLogAction.channel_delete: ("anti_channel_delete", "Unauthorized Channel Delete"),
+    discord.AuditLogAction.role_create: ("anti_role_create", "Unauthorized Role Creation"),
+    discord.AuditLogAction.role_delete: ("anti_role_delete", "Unauthorized Role Deletion"),
+    discord.AuditLogAction.role_update: ("anti_role_update", "Unauthorized Role Update"),
+    discord.AuditLogAction.webhook_create: ("anti_webhook", "Unauthorized Webhook Creation"),
+    discord.AuditLogAction.guild_update: ("anti_raid", "Vanity URL Change Detected"),
+}
+
+async def undo_missed_entry(guild: discord.Guild, entry):
+    # best-effort equivalent of what the live handler would have reverted
+    action, target_id = entry.action, getattr(entry.target, "id", None)
+    try:
+        if action == discord.AuditLogAction.channel_create:
+            ch = guild.get_channel(target_id)
+            if ch:
+                await ch.delete(reason="Anti-Raid: Unauthorized Channel Create (catch-up)")
+        elif action == discord.AuditLogAction.role_create:
+            role = guild.get_role(target_id)
+            if role:
+                await role.delete(reason="Anti-Raid: Unauthorized Role Creation (catch-up)")
+        elif action == discord.AuditLogAction.role_update:
+            role = guild.get_role(target_id)
+            gained = dangerous_gain(getattr(entry.before, "permissions", discord.Permissions.none()).value,
+                                    getattr(entry.after, "permissions", discord.Permissions.none()).value)
+            if role and gained and role.permissions.value & gained:
+                await role.edit(permissions=discord.Permissions(role.permissions.value & ~gained), reason="Anti-Raid: revert dangerous permissions (catch-up)")
+        elif action == discord.AuditLogAction.webhook_create:
+            for wh in await guild.webhooks():
+                if wh.id == target_id:
+                    await wh.delete(reason="Anti-Webhook: unauthorized (catch-up)")
+    except Exception:
+        pass
+
+async def catch_up_guild(guild: discord.Guild, licenses_doc, d):
+    if not license_valid_for_guild(guild.id, licenses_doc):
+        forget_audit_cursor(guild.id)
+        return 0, 0
+    cursor = audit_cursors.get(guild.id)
+    if cursor is None:
+        # first sight of this guild: start from its newest entry, nothing to replay
+        try:
+            async for entry in guild.audit_logs(limit=1):
+                note_audit_cursor(guild.id, entry.id)
+        except Exception:
+            pass
+        return 0, 0
+    p = get_policy(guild.id)
+    scanned, offenders = 0, defaultdict(list)
+    try:
+        async for entry in guild.audit_logs(limit=AUDIT_CATCHUP_MAX, after=discord.Object(id=cursor), oldest_first=True):
+            scanned += 1
+            note_audit_cursor(guild.id, entry.id)
+            spec = CATCHUP_ACTIONS.get(entry.action)
+            actor = entry.user
+            if not spec or not getattr(p, spec[0]) or actor is None:
+                continue
+            if actor.bot or actor.id == bot.user.id or is_whitelisted(guild.id, actor.id, d):
+                continue
+            if entry.action == discord.AuditLogAction.guild_update and getattr(entry.before, "vanity_url_code", None) == getattr(entry.after, "vanity_url_code", None):
+                continue
+            if entry.action == discord.AuditLogAction.role_update and not dangerous_gain(
+                    getattr(entry.before, "permissions", discord.Permissions.none()).value,
+                    getattr(entry.after, "permissions", discord.Permissions.none()).value):
+                continue
+            await undo_missed_entry(guild, entry)
+            offenders[actor.id].append((actor, spec[1]))
+    except Exception as e:
+        print(f"[!] audit catch-up failed for guild {guild.id}: {e}")
+    for actor_id, hits in offenders.items():
+        actor = hits[0][0]
+        kinds = defaultdict(int)
+        for _, label in hits:
+            kinds[label] += 1
+        summary = ", ".join(f"{label} x{n}" for label, n in kinds.items())
+        await log_shame_and_record(guild, actor, f"Missed while disconnected: {summary}", status="CAUGHT UP")
+        await fast_punish(guild, actor, f"Missed while disconnected: {summary}")
+    return scanned, sum(len(h) for h in offenders.values())
+
+async def audit_catchup(guilds):
+    licenses_doc, d = licenses, data
+    sem = asyncio.Semaphore(max(1, AUDIT_CATCHUP_CONCURRENCY))
+    results = []
+
+    async def one(g):
+        async with sem:
+            results.append(await catch_up_guild(g, licenses_doc, d))
+
+    start = time.monotonic()
+    await asyncio.gather(*(one(g) for g in guilds))
+    scanned = sum(r[0] for r in results)
+    acted = sum(r[1] for r in results)
+    metrics.inc("bot_audit_catchup_entries_total", value=scanned)
+    metrics.inc("bot_audit_catchup_actions_total", value=acted)
+    ready_stats["audit_catchup"] = f"{scanned} entries / {acted} actions"
+    if scanned:
+        print(f"Audit catch-up: {scanned} missed entries in {len(guilds)} guilds, {acted} acted on ({time.monotonic() - start:.2f}s)")
+
+# ---------------- Integrity sweeper ----------------
+# Background check for drift the event handlers never saw (missed gateway
+# events, changes made while a shard was down). Every licensed guild keeps a
+# baseline of 64-bit fingerprints per channel/role/webhook; gateway events
+# keep it current, and each tick re-fingerprints a rotating slice of guilds
+# until SWEEP_BUDGET_MS of loop time is spent. Unchanged objects cost one
+# small hash and a dict lookup. Anything that differs is reported to the
+# logs channel and the journal, then adopted as the new baseline.
+SWEEP_INTERVAL_SECONDS = float(os.getenv("SWEEP_INTERVAL_SECONDS", "60"))
+SWEEP_BUDGET_MS = float(os.getenv("SWEEP_BUDGET_MS", "50"))
+SWEEP_MAX_GUILDS = int(os.getenv("SWEEP_MAX_GUILDS", "25"))
+SWEEP_KINDS = ("channels", "roles", "webhooks")
+
+guild_baselines = {}  # guild_id -> {"channels"|"roles"|"webhooks": {object_id: fingerprint}}
+baselines_dirty = set()
+webhook_resync = set()  # guilds whose webhooks changed via events since the last sweep
+sweep_queue = deque()
+sweep_stats = {"ticks": 0, "guilds": 0, "objects": 0, "drift": 0, "last_ms": 0.0}
+
+def fingerprint(*parts) -> int:
+    return int.from_bytes(hashlib.blake2b(repr(parts).encode(), digest_size=8).digest(), "big")
+
+def channel_fingerprint(ch) -> int:
+    ow = sorted((t.id, *(p.value for p in o.pair())) for t, o in ch.overwrites.items())
+    return fingerprint(ch.name, str(ch.type), getattr(ch, "category_id", None), ow)
+
+def role_fingerprint(role) -> int:
+    return fingerprint(role.name, role.permissions.value, role.hoist, role.mentionable, role.managed)
+
+def webhook_fingerprint(wh) -> int:
+    return fingerprint(wh.name, wh.channel_id, str(wh.type))
+
+def load_baselines():
+    for gid, kinds in store.get("baselines").items():
+        guild_baselines[int(gid)] = {k: {int(i): fp for i, fp in kinds.get(k, {}).items()} for k in SWEEP_KINDS}
+
+def save_baselines(snapshot: dict):
+    def merge(doc):
+        for gid, kinds in snapshot.items():
+            doc[str(gid)] = {k: {str(i): fp for i, fp in objs.items()} for k, objs in kinds.items()}
+    store.update("baselines", merge)
+
+load_baselines()
+
+def baseline_note(guild_id: int, kind: str, obj_id: int, fp=None):
+    # gateway event seen: keep the baseline in step so the sweeper stays quiet
+    base = guild_baselines.get(guild_id)
+    if base is None:
+        return
+    if fp is None:
+        base[kind].pop(obj_id, None)
+    else:
+        base[kind][obj_id] = fp
+    baselines_dirty.add(guild_id)
+
+@bot.listen("on_guild_channel_create")
+async def baseline_channel_create(channel):
+    baseline_note(channel.guild.id, "channels", channel.id, channel_fingerprint(channel))
+
+@bot.listen("on_guild_channel_update")
+async def baseline_channel_update(before, after):
+    baseline_note(after.guild.id, "channels", after.id, channel_fingerprint(after))
+
+@bot.listen("on_guild_channel_delete")
+async def baseline_channel_delete(channel):
+    baseline_note(channel.guild.id, "channels", channel.id)
+
+@bot.listen("on_webhooks_update")
+async def baseline_webhooks_update(channel):
+    # the event carries no webhook data; adopt the guild's webhooks quietly on its next sweep
+    webhook_resync.add(channel.guild.id)
+
+@bot.listen("on_guild_role_create")
+async def baseline_role_create(role):
+    baseline_note(role.guild.id, "roles", role.id, role_fingerprint(role))
+
+@bot.listen("on_guild_role_update")
+async def baseline_role_update(before, after):
+    baseline_note(after.guild.id, "roles", after.id, role_fingerprint(after))
+
+@bot.listen("on_guild_role_delete")
+async def baseline_role_delete(role):
+    baseline_note(role.guild.id, "roles", role.id)
+
+def diff_objects(kind: str, old: dict, current: dict, names: dict):
+    drift = []
+    for oid, fp in current.items():
+        prev = old.get(oid)
+        if prev is None:
+            drift.append(f"{kind[:-1]} {names.get(oid, oid)} appeared")
+        elif prev != fp:
+            drift.append(f"{kind[:-1]} {names.get(oid, oid)} changed")
+    for oid in old.keys() - current.keys():
+        drift.append(f"{kind[:-1]} {oid} disappeared")
+    return drift
+
+async def sweep_guild(guild: discord.Guild):
+    # returns (loop seconds spent, objects checked)
+    start = time.perf_counter()
+    current = {
+        "channels": {ch.id: channel_fingerprint(ch) for ch in guild.channels},
+        "roles": {r.id: role_fingerprint(r) for r in guild.roles},
+    }
+    names = {ch.id: f"#{ch.name}" for ch in guild.channels}
+    names.update({r.id: f"@{r.name}" for r in guild.roles})
+    spent = time.perf_counter() - start
+    if guild.me.guild_permissions.manage_webhooks:
+        try:
+            hooks = await guild.webhooks()
+        except Exception:
+            hooks = None
+        if hooks is not None:
+            start = time.perf_counter()
+            current["webhooks"] = {wh.id: webhook_fingerprint(wh) for wh in hooks}
+            names.update({wh.id: f"webhook {wh.name}" for wh in hooks})
+            spent += time.perf_counter() - start
+    start = time.perf_counter()
+    objects = sum(len(v) for v in current.values())
+    base = guild_baselines.get(guild.id)
+    if base is None:
+        # first visit: record, nothing to compare against
+        guild_baselines[guild.id] = {k: current.get(k, {}) for k in SWEEP_KINDS}
+        baselines_dirty.add(guild.id)
+        return spent + time.perf_counter() - start, objects
+    drift = []
+    if "webhooks" in current and guild.id in webhook_resync:
+        webhook_resync.discard(guild.id)
+        base["webhooks"] = current.pop("webhooks")
+        baselines_dirty.add(guild.id)
+    for kind, objs in current.items():
+        drift.extend(diff_objects(kind, base[kind], objs, names))
+        base[kind] = objs
+    spent += time.perf_counter() - start
+    if drift:
+        baselines_dirty.add(guild.id)
+        sweep_stats["drift"] += len(drift)
+        metrics.inc("bot_sweeper_drift_total", value=len(drift))
+        summary = "; ".join(drift[:10]) + (f" (+{len(drift) - 10} more)" if len(drift) > 10 else "")
+        record_incident(guild, None, f"Integrity drift: {summary}", "DRIFT")
+        lines = ["[SYSTEM: INTEGRITY DRIFT]", "──────────────────────────────────────"]
+        lines += drift[:15] + ([f"... {len(drift) - 15} more"] if len(drift) > 15 else [])
+        lines += ["──────────────────────────────────────", "Changes were not seen as events; review the audit log."]
+        await send_alert(guild, shell_block(lines), include_shame=False)
+    return spent, objects
+
+@tasks.loop(seconds=SWEEP_INTERVAL_SECONDS)
+async def integrity_sweeper():
+    if overload.shedding:
+        overload.drop("integrity_sweep")
+        return
+    if not sweep_queue:
+        licensed = licensed_guild_ids()
+        sweep_queue.extend(g.id for g in bot.guilds if g.id in licensed)
+    budget = SWEEP_BUDGET_MS / 1000
+    spent, visited = 0.0, 0
+    while sweep_queue and spent < budget and visited < SWEEP_MAX_GUILDS:
+        g = bot.get_guild(sweep_queue.popleft())
+        if not g or not shard_is_ready(g):
+            continue
+        try:
+            took, objects = await sweep_guild(g)
+        except Exception as e:
+            print(f"[!] integrity sweep failed for guild {g.id}: {e}")
+            continue
+        spent += took
+        visited += 1
+        sweep_stats["objects"] += objects
+    sweep_stats["ticks"] += 1
+    sweep_stats["guilds"] += visited
+    sweep_stats["last_ms"] = spent * 1000
+    metrics.observe("bot_sweeper_tick_seconds", spent)
+    if baselines_dirty:
+        snapshot = {gid: {k: dict(v) for k, v in guild_baselines[gid].items()} for gid in baselines_dirty if gid in guild_baselines}
+        baselines_dirty.clear()
+        try:
+            await run_blocking(save_baselines, snapshot)
+        except Exception as e:
+            baselines_dirty.update(snapshot)
+            print(f"[!] baseline flush failed: {e}")
+
+def sweeper_report():
+    return (
+        f"[sweeper] {sweep_stats['ticks']} ticks | {sweep_stats['guilds']} guild visits | "
+        f"{sweep_stats['objects']} objects | {sweep_stats['drift']} drift | last tick {sweep_stats['last_ms']:.1f}ms "
+        f"(budget {SWEEP_BUDGET_MS:g}ms) | queue {len(sweep_queue)}"
+    )
+
+# ---------------- Link / invite filter ----------------
+# Blocked domains and phrases come from data["blocked_domains"] /
+# data["blocked_phrases"] plus one-entry-per-line files (LINK_DOMAINS_FILE,
+# LINK_PHRASES_FILE) for large feeds. Domains live in a set and a host is
+# checked suffix by suffix (a.b.evil.com -> b.evil.com -> evil.com), phrases
+# in an Aho-Corasick automaton, so scanning a message is one regex pass over
+# its hosts plus one automaton pass over its text, independent of list size.
+# A host token only starts at a boundary and only its last 253 characters and
+# last few labels (as many as the longest listed domain has) are tested, so
+# crafted label chains cost linear time. The filter is rebuilt off the loop,
+# and only when a list changes. It only acts in licensed guilds and never on
+# whitelisted members or members with Manage Server / Administrator.
+LINK_DOMAINS_FILE = os.getenv("LINK_DOMAINS_FILE", os.path.join(DATA_DIR, "blocked_domains.txt"))
+LINK_PHRASES_FILE = os.getenv("LINK_PHRASES_FILE", os.path.join(DATA_DIR, "blocked_phrases.txt"))
+HOST_RE = re.compile(r"(?<![a-z0-9.-])[a-z0-9.-]+\.[a-z][a-z0-9-]*(?:/[^\s<>]*)?")
+HOST_MAX_LEN = 253
+INVITE_HOSTS = {"discord.gg": "/", "dsc.gg": "/", "discord.com": "/invite/", "discordapp.com": "/invite/"}
+
+class AhoCorasick:
+    def __init__(self, patterns):
+        self.patterns = patterns
+        goto, out = [{}], [()]
+        for idx, pat in enumerate(patterns):
+            s = 0
+            for ch in pat:
+                nxt = goto[s].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[s][ch] = nxt
+                    goto.append({})
+                    out.append(())
+                s = nxt
+            out[s] += (idx,)
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            r = queue.popleft()
+            for ch, s in goto[r].items():
+                queue.append(s)
+                f = fail[r]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[s] = goto[f].get(ch, 0)
+                out[s] += out[fail[s]]
+        self.goto, self.fail, self.out = goto, fail, out
+
+    def iter(self, text: str):
+        # (end index, pattern index) for every occurrence
+        goto, fail, out = self.goto, self.fail, self.out
+        s = 0
+        for i, ch in enumerate(text):
+            while s and ch not in goto[s]:
+                s = fail[s]
+            s = goto[s].get(ch, 0)
+            if out[s]:
+                for idx in out[s]:
+                    yield i, idx
+
+class LinkFilter:
+    def __init__(self, domains=(), phrases=()):
+        self.domains = frozenset(d.strip().lower().lstrip("*.") for d in domains if d.strip())
+        self.max_labels = max([d.count(".") + 1 for d in self.domains] + [2])
+        phrases = sorted({p.strip().casefold() for p in phrases if p.strip()})
+        self.phrases = AhoCorasick(phrases) if phrases else None
+
+    def scan(self, text: str):
+        # first hit as (kind, match) -- kind is "invite", "domain" or "phrase"
+        low = text.casefold()
+        if "." in low:
+            for m in HOST_RE.finditer(low):
+                host, slash, path = m.group(0).partition("/")
+                labels = host[-HOST_MAX_LEN:].split(".")
+                for i in range(max(0, len(labels) - self.max_labels), len(labels) - 1):
+                    suffix = ".".join(labels[i:])
+                    prefix = INVITE_HOSTS.get(suffix)
+                    if prefix and (slash + path).startswith(prefix) and len(slash + path) > len(prefix):
+                        return "invite", m.group(0)
+                    if suffix in self.domains:
+                        return "domain", suffix
+        if self.phrases is not None:
+            for end, idx in self.phrases.iter(low):
+                start = end - len(self.phrases.patterns[idx]) + 1
+                if (start == 0 or not low[start - 1].isalnum()) and (end + 1 == len(low) or not low[end + 1].isalnum()):
+                    return "phrase", self.phrases.patterns[idx]
+        return None
+
+link_filter = LinkFilter()
+
+def is_guild_staff(member) -> bool:
+    # owners, admins and server managers post links and invites as part of the job
+    perms = getattr(member, "guild_permissions", None)
+    return bool(perms) and (getattr(perms, "administrator", False) or getattr(perms, "manage_guild", False))
+link_filter_sig = None
+
+def read_list_file(path: str):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    except FileNotFoundError:
+        return []
+
+def link_lists_signature(d: dict):
+    def mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+    return (mtime(LINK_DOMAINS_FILE), mtime(LINK_PHRASES_FILE),
+            hash(tuple(d.get("blocked_domains", ()))), hash(tuple(d.get("blocked_phrases", ()))))
+
+def build_link_filter(d: dict):
+    domains = read_list_file(LINK_DOMAINS_FILE) + list(d.get("blocked_domains", []))
+    phrases = read_list_file(LINK_PHRASES_FILE) + list(d.get("blocked_phrases", []))
+    return LinkFilter(domains, phrases)
+
+@tasks.loop(seconds=30)
+async def link_filter_refresh():
+    global link_filter, link_filter_sig
+    try:
+        sig = await run_blocking(link_lists_signature, data)
+        if sig == link_filter_sig:
+            return
+        start = time.perf_counter()
+        link_filter = await run_blocking(build_link_filter, data)
+        link_filter_sig = sig
+        metrics.observe("bot_link_filter_build_seconds", time.perf_counter() - start)
+        print(f"Link filter rebuilt: {len(link_filter.domains)} domains, "
+              f"{len(link_filter.phrases.patterns) if link_filter.phrases else 0} phrases ({time.perf_counter() - start:.2f}s)")
+    except Exception as e:
+        print(f"[!] link filter rebuild failed: {e}")
+
+# ---------------- Duplicate-content detection ----------------
+# Catches raids where many accounts post the same text once each. Every
+# message is normalised (NFKC, casefold, punctuation and spacing dropped,
+# capped at DUP_MAX_CHARS) and gets an exact 64-bit hash plus a 64-bit
+# SimHash over its first DUP_MAX_SHINGLES character 4-grams. A guild's index
+# maps both onto content clusters; near-duplicates are found through eight
+# 8-bit SimHash bands (any two hashes within 7 bits share at least one band). Clusters expire after the guild's
+# spam_dup_window; once spam_dup_authors distinct authors post into one, they
+# are all timed out and their messages removed in a single batch. Off unless
+# spam_dup_authors is set (globally or per guild), since a popular copypasta
+# or announcement echo would otherwise time out ordinary members.
+DUP_MIN_CHARS = int(os.getenv("DUP_MIN_CHARS", "12"))
+DUP_MAX_CHARS = 512
+DUP_MAX_SHINGLES = 128
+DUP_MAX_CLUSTERS = int(os.getenv("DUP_MAX_CLUSTERS", "2000"))
+SIMHASH_MAX_DISTANCE = 7
+SIMHASH_BANDS = 8
+DUP_MAX_CANDIDATES = 32  # SimHash comparisons per message, whatever the band occupancy
+
+def normalize_content(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text[:DUP_MAX_CHARS * 2]).casefold()
+    return " ".join("".join(c if c.isalnum() else " " for c in text).split())[:DUP_MAX_CHARS]
+
+def hash64(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big")
+
+def simhash(normalized: str) -> int:
+    shingles = [normalized[i:i + 4] for i in range(min(DUP_MAX_SHINGLES, max(1, len(normalized) - 3)))]
+    # per-bit majority vote with bit-sliced counters: counters[i] holds bit i
+    # of all 64 column counts, so adding a shingle is a short carry chain.
+    # str hash() is per-process, which is fine for an in-memory index.
+    counters = []
+    for sh in shingles:
+        carry = hash(sh) & 0xFFFFFFFFFFFFFFFF
+        for i in range(len(counters)):
+            counters[i], carry = counters[i] ^ carry, counters[i] & carry
+            if not carry:
+                break
+        if carry:
+            counters.append(carry)
+    # columns whose count exceeds half, compared most significant bit first
+    half = len(shingles) // 2
+    gt, eq = 0, 0xFFFFFFFFFFFFFFFF
+    for i in reversed(range(len(counters))):
+        c = counters[i]
+        if (half >> i) & 1:
+            eq &= c
+        else:
+            gt |= eq & c
+            eq &= ~c
+    return gt
+
+def simhash_bands(h: int):
+    return [(i, (h >> (8 * i)) & 0xFF) for i in range(SIMHASH_BANDS)]
+
+class ContentCluster:
+    __slots__ = ("exact", "sim", "last_seen", "authors", "flagged")
+
+    def __init__(self, exact: int, sim: int, now: float):
+        self.exact = exact
+        self.sim = sim
+        self.last_seen = now
+        self.authors = {}  # user_id -> [(channel_id, message_id), ...]
+        self.flagged = False
+
+class ContentIndex:
+    """Per-guild duplicate-content index, bounded by time window and cluster count."""
+
+    def __init__(self):
+        self.clusters = {}  # exact hash -> ContentCluster
+        self.bands = {}     # (band, value) -> set of exact hashes
+        self.expiry = deque()  # (last_seen at insert, exact hash)
+
+    def _drop(self, cluster: ContentCluster):
+        self.clusters.pop(cluster.exact, None)
+        for band in simhash_bands(cluster.sim):
+            keys = self.bands.get(band)
+            if keys:
+                keys.discard(cluster.exact)
+                if not keys:
+                    del self.bands[band]
+
+    def expire(self, now: float, window: float):
+        while self.expiry and (now - self.expiry[0][0] > window or len(self.clusters) > DUP_MAX_CLUSTERS):
+            ts, exact = self.expiry.popleft()
+            c = self.clusters.get(exact)
+            if c is not None and (c.last_seen <= ts or len(self.clusters) > DUP_MAX_CLUSTERS):
+                self._drop(c)
+
+    def match(self, exact: int, sim: int):
+        c = self.clusters.get(exact)
+        if c is not None:
+            return c
+        budget = DUP_MAX_CANDIDATES
+        for band in simhash_bands(sim):
+            for key in self.bands.get(band, ()):
+                c = self.clusters[key]
+                if bin(c.sim ^ sim).count("1") <= SIMHASH_MAX_DISTANCE:
+                    return c
+                budget -= 1
+                if not budget:
+                    return None
+        return None
+
+    def add(self, normalized: str, author_id: int, channel_id: int, message_id: int, now: float, window: float):
+        self.expire(now, window)
+        exact, sim = hash64(normalized), simhash(normalized)
+        c = self.match(exact, sim)
+        if c is None:
+            c = self.clusters[exact] = ContentCluster(exact, sim, now)
+            for band in simhash_bands(sim):
+                self.bands.setdefault(band, set()).add(exact)
+        c.last_seen = now
+        self.expiry.append((now, c.exact))
+        refs = c.authors.setdefault(author_id, [])
+        if len(refs) < 5:
+            refs.append((channel_id, message_id))
+        return c
+
+content_indexes = defaultdict(ContentIndex)
+
+async def punish_content_cluster(guild: discord.Guild, authors: dict, p: GuildPolicy):
+    # one batch: bulk-delete per channel, then time out every author concurrently
+    authors = {uid: refs for uid, refs in authors.items() if not is_whitelisted(guild.id, uid)}
+    # members the bot cannot moderate (owner, same or higher top role) are left alone
+    blocked = [m for m in (guild.get_member(uid) for uid in authors) if m is not None and not can_moderate(guild, m)]
+    for m in blocked:
+        authors.pop(m.id, None)
+        await log_shame_and_record(guild, m, "Cannot punish higher-role member for Duplicate-content raid", status="HIERARCHY BLOCK")
+    if not authors:
+        return
+    by_channel = defaultdict(list)
+    for refs in authors.values():
+        for channel_id, message_id in refs:
+            by_channel[channel_id].append(discord.Object(id=message_id))
+    for channel_id, msgs in by_channel.items():
+        ch = guild.get_channel(channel_id)
+        if ch is None:
+            continue
+        try:
+            for i in range(0, len(msgs), 100):
+                await ch.delete_messages(msgs[i:i + 100], reason="Duplicate-content raid")
+        except Exception:
+            pass
+    members = [m for m in (guild.get_member(uid) for uid in authors) if m is not None and not m.bot]
+    results = await asyncio.gather(*(timeout_member(m, p.rate_limit_hours, reason="Duplicate-content raid") for m in members),
+                                   return_exceptions=True)
+    metrics.inc("bot_dup_content_punished_total", value=sum(1 for r in results if r is True))
+    for m, r in zip(members, results):
+        status = "TIMED OUT" if r is True else "FORBIDDEN" if isinstance(r, discord.Forbidden) else "FAILED"
+        await log_shame_and_record(guild, m, f"Duplicate-content raid ({len(authors)} accounts)", status=status)
+
+async def check_duplicate_content(message: discord.Message, p: GuildPolicy):
+    if p.spam_dup_authors <= 0 or not message.content:
+        return
+    normalized = normalize_content(message.content)
+    if len(normalized) < DUP_MIN_CHARS:
+        return
+    c = content_indexes[message.guild.id].add(normalized, message.author.id, message.channel.id, message.id,
+                                               asyncio.get_event_loop().time(), p.spam_dup_window)
+    if c.flagged:
+        # cluster already punished: late joiners are handled one by one
+        if len(c.authors[message.author.id]) == 1:
+            await punish_content_cluster(message.guild, {message.author.id: c.authors[message.author.id]}, p)
+        return
+    if len(c.authors) >= p.spam_dup_authors:
+        c.flagged = True
+        metrics.inc("bot_dup_content_clusters_total")
+        await punish_content_cluster(message.guild, dict(c.authors), p)
+
 # ---------------- Spam detection -> timeout only ----------------
+async def spam_strike(message: discord.Message, p: GuildPolicy, key, action_str: str, status: str):
+    # purge the author's recent messages, count a strike, time out once enough strikes pile up
+    uid = message.author.id
+    try:
+        await message.channel.purge(limit=200, check=lambda m: m.author.id == uid)
+    except Exception:
+        pass
+    spam_strikes[key] += 1
+    try:
+        await log_shame_and_record(message.guild, message.author, action_str, status=status)
+    except Exception:
+        pass
+    if spam_strikes[key] >= p.spam_strike_timeout_threshold:
+        spam_strikes[key] = 0
+        if message.guild is None:
+            return
+        # the fixed timeout stays the floor; the ladder only lengthens it or goes to kick/ban
+        action, hours = next_punishment(p, message.guild.id, uid, ("timeout", p.rate_limit_hours))
+        try:
+            if action == "timeout":
+                done = await timeout_member(message.author, hours, reason="Spam rate-limit")
+            elif action == "kick":
+                await message.author.kick(reason=f"Repeat spam: {action_str}")
+                await log_shame_and_record(message.guild, message.author, f"Kicked (repeat offender) for {action_str}", status="AUTO-KICKED")
+                done = True
+            else:
+                done = await ban_member(message.guild, message.author, action_str)
+            if done:
+                record_offense(message.guild.id, uid)
+        except Exception:
+            pass
+
 @bot.event
+@instrumented
 async def on_message(message: discord.Message):
+    note_shard_event(message.guild)
     if message.author.bot:
         await bot.process_commands(message)
         return
-    d = load_data()
-    threshold = int(d.get("spam_delete_threshold", 5))
-    window = int(d.get("spam_delete_window", 5))
-    strikes_needed = int(d.get("spam_strike_timeout_threshold", 1))
+    p = get_policy(message.guild.id if message.guild else None)
+    threshold = p.spam_delete_threshold
+    window = p.spam_delete_window
     uid = message.author.id
+    key = (message.guild.id if message.guild else None, uid)
     now = asyncio.get_event_loop().time()
-    q = spam_tracker[uid]
+    q = spam_tracker[key]
     q.append(now)
     while q and now - q[0] > window:
         q.popleft()
     if threshold > 0 and len(q) >= threshold:
-        try:
-            await message.channel.purge(limit=200, check=lambda m: m.author.id == uid)
-        except Exception:
-            pass
-        spam_strikes[uid] += 1
-        try:
-            await log_shame_and_record(message.guild, message.author, "Spam messages auto-deleted", status="SPAM_DELETED")
-        except Exception:
-            pass
-        if spam_strikes[uid] >= strikes_needed:
-            try:
-                await timeout_member(message.author, int(d.get("rate_limit_hours", 12)), reason="Spam rate-limit")
-                spam_strikes[uid] = 0
-            except Exception:
-                pass
+        await spam_strike(message, p, key, "Spam messages auto-deleted", "SPAM_DELETED")
+    if message.guild and p.anti_link and message.content:
+        hit = link_filter.scan(message.content)
+        if (hit and (hit[0] != "invite" or p.block_invites) and not is_whitelisted(message.guild.id, uid)
+                and not is_guild_staff(message.author)
+                and license_valid_for_guild(message.guild.id)):
+            metrics.inc("bot_link_filter_hits_total", (("kind", hit[0]),))
+            await spam_strike(message, p, key, f"Blocked {hit[0]}: {hit[1][:80]}", "LINK_BLOCKED")
+            return
+    if message.guild:
+        await check_duplicate_content(message, p)
     await bot.process_commands(message)
 
 # ---------------- Background tasks ----------------
 @tasks.loop(minutes=1)
 async def expire_check():
-    l = load_licenses()
-    changed = False
-    for k, v in list(l.get("keys", {}).items()):
-        exp = v.get("expires_at")
-        if exp == "permanent":
-            continue
-        exp_dt = iso_to_dt(exp)
-        if not exp_dt:
-            continue
-        if exp_dt < datetime.now(timezone.utc):
-            if v.get("guild_id"):
-                guild_id = v.get("guild_id")
+    def unbind_expired(l):
+        expired = []
+        for k, v in l.get("keys", {}).items():
+            exp = v.get("expires_at")
+            if exp == "permanent":
+                continue
+            exp_dt = iso_to_dt(exp)
+            if not exp_dt:
+                continue
+            if exp_dt < datetime.now(timezone.utc) and v.get("guild_id"):
+                expired.append((k, v["guild_id"]))
+                queue_teardown(l, v["guild_id"], "License expired")
                 v["guild_id"] = None
                 v["used"] = True
                 v["user_id"] = None
-                l["keys"][k] = v
-                changed = True
-                await post_webhook(f"License expired: key {k} expired and was unbound from guild {guild_id}")
-                g = bot.get_guild(int(guild_id))
-                if g:
-                    d = load_data()
-                    for ch_name in (d.get("panel_channel_name", "security-panel"), d.get("logs_channel_name", "security-logs"), d.get("shame_channel_name", "shame")):
-                        ch = discord.utils.get(g.channels, name=ch_name)
-                        if ch:
-                            try:
-                                await ch.delete(reason="License expired")
-                            except Exception:
-                                pass
-    if changed:
-        save_licenses(l)
+        return expired
+    for k, guild_id in await aupdate_licenses(unbind_expired):
+        await post_webhook(f"License expired: key {k} expired and was unbound from guild {guild_id}")
+    # every worker runs this loop, so each one tears down the guilds it serves
+    await run_pending_teardowns()
 
 @tasks.loop(seconds=5)
 async def panel_updater():
-    d = load_data()
+    if overload.shedding:
+        overload.drop("panel_refresh")
+        return
+    d = data
     pm = d.get("panel_messages", {})
     for guild_id_str, msg_id in list(pm.items()):
         try:
             guild_id = int(guild_id_str)
             g = bot.get_guild(guild_id)
-            if not g:
+            if not g or not shard_is_ready(g):
                 continue
             ch = discord.utils.get(g.text_channels, name=d.get("panel_channel_name", "security-panel"))
             if not ch:
@@ -1182,29 +3394,804 @@ async def panel_updater():
         except Exception:
             continue
 
+def apply_data_update(new: dict):
+    # swap the in-memory settings and rebuild policies of guilds whose overlay
+    # changed; everything that can fail is computed before anything is mutated
+    global whitelist_sets
+    old_overlays = data.get("guild_settings", {})
+    new_overlays = new.get("guild_settings", {})
+    globals_changed = any(data.get(k) != new.get(k) for k in POLICY_KEYS)
+    stale = {int(gid) for gid in set(old_overlays) | set(new_overlays) if old_overlays.get(gid) != new_overlays.get(gid)}
+    panels = {int(k): int(v) for k, v in new.get("panel_messages", {}).items()}
+    wl_sets = build_whitelist_sets(new)
+    data.clear()
+    data.update(new)
+    whitelist_sets = wl_sets
+    if globals_changed:
+        guild_policies.clear()
+    else:
+        for gid in stale:
+            guild_policies.pop(gid, None)
+    panel_message_map.clear()
+    panel_message_map.update(panels)
+
+@tasks.loop(seconds=float(os.getenv("STORE_POLL_SECONDS", "2")))
+async def store_sync():
+    # picks up writes made by other processes (cluster mode) or by hand
+    try:
+        v = await run_blocking(store.version, "security")
+        if v != store_versions.get("security"):
+            store_versions["security"] = v
+            # json files are only written by this process, so a change there
+            # is a hand edit; the sqlite store is shared, so a change there is
+            # a peer worker's panel or command write and is applied quietly
+            await reload_security_doc(announce=not isinstance(store, SqliteStore))
+        v = await run_blocking(store.version, "licenses")
+        if v != store_versions.get("licenses"):
+            store_versions["licenses"] = v
+            apply_licenses_update(await aload_licenses())
+            await run_pending_teardowns()
+    except Exception as e:
+        print(f"[!] store_sync error: {e}")
+
+# ---------------- Hot config reload ----------------
+# security.json edited by hand (or by another process) is picked up by
+# store_sync, .env by config_watch; neither needs a restart. Handlers read
+# settings and whitelists only from the in-memory doc, never from the store,
+# so a new security doc takes effect only once validated; it is rejected as a
+# whole if anything is off (or it does not parse). Otherwise it is swapped in
+# with apply_data_update (no await in between, so handlers see either the old
+# or the new settings), hand edits are logged, and the panels of affected
+# guilds are refreshed. .env keys in RELOADABLE_ENV
+# are re-parsed together and assigned only if all of them parse; changed keys
+# in RESTART_ENV are reported as needing a restart, any others as unused.
+CONFIG_POLL_SECONDS = float(os.getenv("CONFIG_POLL_SECONDS", "2"))
+ENV_FILE = find_dotenv()
+SECURITY_STR_KEYS = ("shame_channel_name", "logs_channel_name", "panel_channel_name", "verify_channel_name", "verify_role_name")
+
+def validate_security(doc) -> list:
+    if not isinstance(doc, dict):
+        return ["top level must be an object"]
+    errors = []
+    for k in POLICY_BOOL_KEYS:
+        if k in doc and not isinstance(doc[k], bool):
+            errors.append(f"{k} must be true/false")
+    for k in POLICY_INT_KEYS:
+        if k in doc and (isinstance(doc[k], bool) or not isinstance(doc[k], int) or doc[k] < 0):
+            errors.append(f"{k} must be a non-negative integer")
+    for k in SECURITY_STR_KEYS:
+        if k in doc and (not isinstance(doc[k], str) or not doc[k].strip()):
+            errors.append(f"{k} must be a non-empty string")
+    for k in ("blocked_domains", "blocked_phrases"):
+        if k in doc and not (isinstance(doc[k], list) and all(isinstance(x, str) for x in doc[k])):
+            errors.append(f"{k} must be a list of strings")
+    wl = doc.get("whitelists", {})
+    if not isinstance(wl, dict) or not all(str(g).isdigit() and isinstance(ids, list) and all(str(i).isdigit() for i in ids) for g, ids in wl.items()):
+        errors.append("whitelists must map guild IDs to lists of user IDs")
+    pm = doc.get("panel_messages", {})
+    if not isinstance(pm, dict) or not all(str(g).isdigit() and str(m).isdigit() for g, m in pm.items()):
+        errors.append("panel_messages must map guild IDs to message IDs")
+    gs = doc.get("guild_settings", {})
+    if not isinstance(gs, dict):
+        errors.append("guild_settings must be an object")
+    else:
+        for gid, overlay in gs.items():
+            if not str(gid).isdigit() or not isinstance(overlay, dict):
+                errors.append(f"guild_settings[{gid}] must be an object keyed by guild ID")
+                continue
+            unknown = set(overlay) - set(POLICY_KEYS)
+            if unknown:
+                errors.append(f"guild_settings[{gid}] has unknown keys: {', '.join(sorted(unknown))}")
+            errors += [f"guild_settings[{gid}].{e}" for e in validate_security({k: v for k, v in overlay.items() if k in POLICY_KEYS})]
+    return errors
+
+def security_diff(old: dict, new: dict) -> list:
+    lines = []
+    for k in sorted(set(old) | set(new)):
+        if k in ("whitelists", "guild_settings", "panel_messages") or old.get(k) == new.get(k):
+            continue
+        if k in ("blocked_domains", "blocked_phrases"):
+            lines.append(f"{k}: {len(old.get(k, []))} -> {len(new.get(k, []))} entries")
+        else:
+            lines.append(f"{k}: {old.get(k)!r} -> {new.get(k)!r}")
+    for kind in ("whitelists", "guild_settings"):
+        a, b = old.get(kind, {}), new.get(kind, {})
+        for gid in sorted(set(a) | set(b)):
+            if a.get(gid) == b.get(gid):
+                continue
+            if kind == "whitelists":
+                added = set(map(int, b.get(gid, []))) - set(map(int, a.get(gid, [])))
+                removed = set(map(int, a.get(gid, []))) - set(map(int, b.get(gid, [])))
+                lines.append(f"whitelists[{gid}]: +{len(added)} -{len(removed)}")
+            else:
+                oa, ob = a.get(gid, {}), b.get(gid, {})
+                for k in sorted(set(oa) | set(ob)):
+                    if oa.get(k) != ob.get(k):
+                        lines.append(f"guild_settings[{gid}].{k}: {oa.get(k)!r} -> {ob.get(k)!r}")
+    return lines
+
+def affected_guilds(old: dict, new: dict):
+    # None = every guild (a global setting or channel name changed)
+    if any(old.get(k) != new.get(k) for k in POLICY_KEYS + SECURITY_STR_KEYS):
+        return None
+    out = set()
+    for kind in ("whitelists", "guild_settings"):
+        a, b = old.get(kind, {}), new.get(kind, {})
+        out |= {int(g) for g in set(a) | set(b) if a.get(g) != b.get(g)}
+    return out
+
+async def refresh_panels(guild_ids=None):
+    d = data
+    for gid, msg_id in list(panel_message_map.items()):
+        if guild_ids is not None and gid not in guild_ids:
+            continue
+        g = bot.get_guild(gid)
+        if not g or not shard_is_ready(g):
+            continue
+        ch = discord.utils.get(g.text_channels, name=d.get("panel_channel_name", "security-panel"))
+        if not ch:
+            continue
+        try:
+            msg = await ch.fetch_message(msg_id)
+            await SecurityPanel().update_embed_for_guild(g, msg)
+        except Exception:
+            continue
+
+async def reload_security_doc(announce: bool = True):
+    try:
+        new = await aload_data()
+    except (ValueError, OSError) as e:
+        print(f"[!] config reload rejected: security doc unreadable ({e}); keeping current settings")
+        metrics.inc("bot_config_reloads_total", (("result", "rejected"),))
+        return
+    errors = validate_security(new)
+    if errors:
+        print("[!] config reload rejected; keeping current settings:\n  " + "\n  ".join(errors[:20]))
+        metrics.inc("bot_config_reloads_total", (("result", "rejected"),))
+        return
+    old = dict(data)
+    changes, guilds = security_diff(old, new), affected_guilds(old, new)
+    apply_data_update(new)
+    metrics.inc("bot_config_reloads_total", (("result", "applied"),))
+    if not changes:
+        return
+    if announce:
+        print("Config reloaded:\n  " + "\n  ".join(changes))
+        await post_webhook("Config reloaded: " + "; ".join(changes)[:1800])
+    if guilds is None or guilds:
+        spawn(refresh_panels(guilds))
+
+# env key -> parser; value is assigned to the module global of the same name
+RELOADABLE_ENV = {
+    "BACKGROUND_IMG_URL": str.strip,
+    "THREAT_TTL_HOURS": float,
+    "OFFENSE_HALF_LIFE_HOURS": float,
+    "OFFENSE_INCIDENT_SECONDS": float,
+    "ESCALATION_LADDER": parse_ladder,
+    "VERIFY_INTERVAL": float,
+    "VERIFY_MIN_ACCOUNT_AGE_DAYS": float,
+    "VERIFY_REQUIRE_AVATAR": lambda v: v == "1",
+    "AUDIT_CATCHUP_MAX": int,
+    "AUDIT_CATCHUP_CONCURRENCY": int,
+    "SWEEP_BUDGET_MS": float,
+    "SWEEP_MAX_GUILDS": int,
+    "DUP_MIN_CHARS": int,
+    "DUP_MAX_CLUSTERS": int,
+    "LINK_DOMAINS_FILE": str,
+    "LINK_PHRASES_FILE": str,
+    "LOOP_STALL_THRESHOLD": float,
+    "OVERLOAD_LAG_ENTER": float,
+    "OVERLOAD_LAG_EXIT": float,
+    "OVERLOAD_TASKS_ENTER": int,
+    "OVERLOAD_TASKS_EXIT": int,
+    "OVERLOAD_MIN_SECONDS": float,
+    "PROVISION_CONCURRENCY": int,
+}
+# loops whose interval follows an env key
+RELOADABLE_INTERVALS = {
+    "SWEEP_INTERVAL_SECONDS": lambda v: integrity_sweeper.change_interval(seconds=float(v)),
+    "ROLE_AUDIT_MINUTES": lambda v: role_permission_audit.change_interval(minutes=float(v)),
+}
+
+# keys read once at startup; any other changed key is not used by the bot
+# (channel and role names live in security.json, which reloads on its own)
+RESTART_ENV = (
+    "BOT_TOKEN", "GUILD_ID", "RUN_MODE", "RUNTIME_PROFILE", "MAX_MESSAGES", "SHARD_COUNT", "SHARD_IDS",
+    "CLUSTER_ID", "CLUSTER_PROCESSES", "DATA_DIR", "STATE_STORE", "STORE_POLL_SECONDS", "CONFIG_POLL_SECONDS",
+    "JOURNAL_MAX_BYTES", "LOOP_LAG_INTERVAL", "METRICS_HOST", "METRICS_PORT", "THREAT_CAPACITY",
+    "THREAT_FP_RATE", "VERIFY_WORKERS",
+)
+
+env_state = {"mtime": None, "values": dotenv_values(ENV_FILE) if ENV_FILE else {}}
+
+def read_env_file():
+    try:
+        mtime = os.stat(ENV_FILE).st_mtime_ns
+    except OSError:
+        return None, None
+    if mtime == env_state["mtime"]:
+        return mtime, None
+    return mtime, dotenv_values(ENV_FILE)
+
+def apply_env_update(values: dict):
+    old = env_state["values"]
+    changed = {k: v for k, v in values.items() if old.get(k) != v}
+    # like load_dotenv, real environment variables win over the file
+    shadowed = sorted(k for k in changed if k in os.environ and os.environ[k] != old.get(k))
+    for k in shadowed:
+        del changed[k]
+    removed = sorted(set(old) - set(values))
+    parsed, errors, restart, unused = {}, [], [], []
+    for k, v in changed.items():
+        if k in RELOADABLE_ENV:
+            try:
+                parsed[k] = RELOADABLE_ENV[k](v)
+            except (TypeError, ValueError) as e:
+                errors.append(f"{k}={v!r}: {e}")
+        elif k in RELOADABLE_INTERVALS:
+            try:
+                parsed[k] = float(v)
+            except (TypeError, ValueError) as e:
+                errors.append(f"{k}={v!r}: {e}")
+        elif k in RESTART_ENV:
+            restart.append(k)
+        else:
+            unused.append(k)
+    if errors:
+        return [], errors, []
+    # all parsed: assign in one go
+    for k, v in parsed.items():
+        if k in RELOADABLE_INTERVALS:
+            RELOADABLE_INTERVALS[k](v)
+        else:
+            globals()[k] = v
+        os.environ[k] = changed[k]
+    env_state["values"] = values
+    lines = [f"{k}: {old.get(k)!r} -> {changed[k]!r}" for k in parsed]
+    lines += [f"{k}: changed, takes effect after a restart" for k in restart]
+    lines += [f"{k}: not used by the bot, ignored" for k in unused]
+    lines += [f"{k}: set in the process environment, .env value ignored" for k in shadowed]
+    lines += [f"{k}: removed from .env, current value kept until restart" for k in removed]
+    return lines, [], restart
+
+@tasks.loop(seconds=CONFIG_POLL_SECONDS)
+async def config_watch():
+    if not ENV_FILE:
+        return
+    try:
+        mtime, values = await run_blocking(read_env_file)
+    except Exception as e:
+        print(f"[!] .env watch failed: {e}")
+        return
+    if mtime is None or values is None:
+        return
+    first = env_state["mtime"] is None
+    env_state["mtime"] = mtime
+    if first:
+        return
+    lines, errors, _ = apply_env_update(values)
+    if errors:
+        print("[!] .env reload rejected; keeping current values:\n  " + "\n  ".join(errors))
+        metrics.inc("bot_config_reloads_total", (("result", "rejected"),))
+        return
+    metrics.inc("bot_config_reloads_total", (("result", "applied"),))
+    if lines:
+        print(".env reloaded:\n  " + "\n  ".join(lines))
+        await post_webhook(".env reloaded: " + "; ".join(lines)[:1800])
+
+# ---------------- Event-loop lag monitor ----------------
+# A coroutine samples how late its own wakeups are (scheduling delay). A
+# watchdog thread notices when those samples stop arriving and dumps the
+# loop thread's stack, i.e. whatever is blocking it right now.
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.25"))
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.5"))
+
+loop_lag = {"last": 0.0, "max": 0.0, "heartbeat": time.monotonic(), "stalls": 0, "thread_id": None}
+
+async def loop_lag_monitor():
+    loop = asyncio.get_running_loop()
+    loop_lag["thread_id"] = threading.get_ident()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - start - LOOP_LAG_INTERVAL)
+        loop_lag["last"] = lag
+        loop_lag["max"] = max(loop_lag["max"], lag)
+        loop_lag["heartbeat"] = time.monotonic()
+        metrics.observe("bot_loop_lag_seconds", lag)
+        overload.update(lag, len(asyncio.all_tasks()))
+
+def loop_stall_watchdog():
+    reported = None
+    while True:
+        time.sleep(LOOP_STALL_THRESHOLD / 2)
+        beat = loop_lag["heartbeat"]
+        stalled = time.monotonic() - beat - LOOP_LAG_INTERVAL
+        if stalled < LOOP_STALL_THRESHOLD or reported == beat:
+            continue
+        reported = beat  # one report per stall
+        loop_lag["stalls"] += 1
+        metrics.inc("bot_loop_stalls_total")
+        frame = sys._current_frames().get(loop_lag["thread_id"])
+        stack = "".join(traceback.format_stack(frame)) if frame else "(no frame)"
+        print(f"[!] Event loop blocked for {stalled:.2f}s, loop thread stack:\n{stack}")
+
+# ---------------- Overload controller ----------------
+# Enters shed mode when loop lag or the number of pending tasks crosses the
+# ENTER thresholds and leaves once both are back under the EXIT thresholds.
+# While shedding, #shame posts and panel refreshes are dropped, repeated logs
+# are suppressed for longer and webhook posts are deferred; punish and revert
+# paths are never shed.
+OVERLOAD_LAG_ENTER = float(os.getenv("OVERLOAD_LAG_ENTER", "0.25"))
+OVERLOAD_LAG_EXIT = float(os.getenv("OVERLOAD_LAG_EXIT", "0.05"))
+OVERLOAD_TASKS_ENTER = int(os.getenv("OVERLOAD_TASKS_ENTER", "400"))
+OVERLOAD_TASKS_EXIT = int(os.getenv("OVERLOAD_TASKS_EXIT", "150"))
+OVERLOAD_MIN_SECONDS = float(os.getenv("OVERLOAD_MIN_SECONDS", "10"))
+OVERLOAD_DEDUPE_WINDOW = 300
+OVERLOAD_MAX_DEFERRED = 200
+
+class OverloadController:
+    def __init__(self):
+        self.shedding = False
+        self.entered_at = 0.0
+        self.entries = 0
+        self.dropped = defaultdict(int)  # kind -> count during the current/last episode
+        self.dropped_total = defaultdict(int)
+        self.deferred_webhooks = deque(maxlen=OVERLOAD_MAX_DEFERRED)
+
+    def update(self, lag: float, depth: int):
+        now = time.monotonic()
+        if not self.shedding:
+            if lag >= OVERLOAD_LAG_ENTER or depth >= OVERLOAD_TASKS_ENTER:
+                self.shedding = True
+                self.entered_at = now
+                self.entries += 1
+                self.dropped.clear()
+                metrics.inc("bot_shed_transitions_total", (("direction", "enter"),))
+                print(f"[!] Overload: entering shed mode (lag {lag * 1000:.0f}ms, {depth} tasks, episode {self.entries})")
+        elif now - self.entered_at >= OVERLOAD_MIN_SECONDS and lag <= OVERLOAD_LAG_EXIT and depth <= OVERLOAD_TASKS_EXIT:
+            self.shedding = False
+            metrics.inc("bot_shed_transitions_total", (("direction", "exit"),))
+            summary = ", ".join(f"{k}={v}" for k, v in sorted(self.dropped.items())) or "nothing"
+            print(f"[!] Overload: leaving shed mode after {now - self.entered_at:.1f}s (shed: {summary}; "
+                  f"{len(self.deferred_webhooks)} webhook posts deferred)")
+            if self.deferred_webhooks:
+                spawn(self.flush_webhooks())
+
+    def drop(self, kind: str):
+        self.dropped[kind] += 1
+        self.dropped_total[kind] += 1
+        metrics.inc("bot_shed_dropped_total", (("kind", kind),))
+
+    def defer_webhook(self, msg: str):
+        if len(self.deferred_webhooks) == self.deferred_webhooks.maxlen:
+            self.drop("webhook_post")
+        self.deferred_webhooks.append(msg)
+        metrics.inc("bot_shed_deferred_total", (("kind", "webhook_post"),))
+
+    async def flush_webhooks(self):
+        while self.deferred_webhooks and not self.shedding:
+            await post_webhook(self.deferred_webhooks.popleft())
+
+    def report(self):
+        state = f"SHEDDING for {time.monotonic() - self.entered_at:.1f}s" if self.shedding else "normal"
+        dropped = ", ".join(f"{k}={v}" for k, v in sorted(self.dropped_total.items())) or "none"
+        return f"[overload] {state} | episodes {self.entries} | shed {dropped} | deferred webhooks {len(self.deferred_webhooks)}"
+
+overload = OverloadController()
+metrics.gauge("bot_shed_mode", lambda: [((), 1 if overload.shedding else 0)], "1 while load shedding is active")
+metrics.gauge("bot_pending_tasks", lambda: [((), len(asyncio.all_tasks()))])
+
+lag_monitor_task = None
+
+def start_lag_monitor():
+    global lag_monitor_task
+    if lag_monitor_task is not None:
+        return
+    lag_monitor_task = asyncio.create_task(loop_lag_monitor())
+    threading.Thread(target=loop_stall_watchdog, name="loop-watchdog", daemon=True).start()
+
+def lag_report():
+    count, mean, p95 = metrics.histogram_summary("bot_loop_lag_seconds")
+    return (
+        f"[loop] lag last {loop_lag['last'] * 1000:.1f}ms | mean {mean * 1000:.1f}ms | "
+        f"p95 <={p95 * 1000:g}ms | max {loop_lag['max'] * 1000:.1f}ms | stalls {loop_lag['stalls']} ({count} samples)"
+    )
+
+# ---------------- On-demand profiling ----------------
+# !profile <seconds> [loop|sample|handler ...] (master owner). "loop" runs
+# cProfile on the loop thread; "sample" or a list of handler names runs a
+# wall-clock stack sampler, optionally keeping only samples taken inside those
+# handlers. Both also diff two tracemalloc snapshots. Nothing needs a restart.
+PROFILE_MAX_SECONDS = 300
+profile_state = {"active": False}
+
+class StackSampler:
+    def __init__(self, thread_id: int, handlers=None, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.handlers = set(handlers or ())
+        self.interval = interval
+        self.samples = 0
+        self.kept = 0
+        self.leaf = defaultdict(int)
+        self.stacks = defaultdict(int)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=2)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, frame.f_lineno, code.co_name))
+                frame = frame.f_back
+            if self.handlers and not any(name in self.handlers for _, _, name in stack):
+                continue
+            self.kept += 1
+            fn, line, name = stack[0]
+            self.leaf[f"{name} ({os.path.basename(fn)}:{line})"] += 1
+            self.stacks[";".join(n for _, _, n in reversed(stack[:25]))] += 1
+
+    def report(self, top: int = 40) -> str:
+        scope = ", ".join(sorted(self.handlers)) or "whole loop"
+        out = [f"Wall-clock sampler ({scope}): {self.kept}/{self.samples} samples kept, interval {self.interval * 1000:g}ms", ""]
+        out.append("Top leaf frames:")
+        for k, v in sorted(self.leaf.items(), key=lambda kv: -kv[1])[:top]:
+            out.append(f"  {v:6d}  {100 * v / max(1, self.kept):5.1f}%  {k}")
+        out.append("")
+        out.append("Top stacks (root;...;leaf):")
+        for k, v in sorted(self.stacks.items(), key=lambda kv: -kv[1])[:top]:
+            out.append(f"  {v:6d}  {k}")
+        return "\n".join(out)
+
+async def run_profile(seconds: float, targets):
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(25)
+    before = tracemalloc.take_snapshot()
+    if not targets or targets == ["loop"]:
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            prof.disable()
+        buf = io.StringIO()
+        pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(60)
+        cpu_report = f"cProfile of the event loop thread for {seconds:g}s\n\n{buf.getvalue()}"
+    else:
+        handlers = [t for t in targets if t != "sample"]
+        sampler = StackSampler(threading.get_ident(), handlers)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+        cpu_report = sampler.report()
+    after = tracemalloc.take_snapshot()
+    if started_tracing:
+        tracemalloc.stop()
+    mem = ["tracemalloc diff (top 30 by size delta):"]
+    for stat in after.compare_to(before, "lineno")[:30]:
+        mem.append(f"  {stat}")
+    return cpu_report + "\n\n" + "\n".join(mem) + "\n"
+
+@bot.command(name="profile")
+async def profile(ctx: commands.Context, seconds: float, *targets: str):
+    if ctx.author.id != MASTER_OWNER_ID:
+        return await ctx.send("Only the master owner can run the profiler.", delete_after=8)
+    if profile_state["active"]:
+        return await ctx.send("A profiling run is already in progress.", delete_after=8)
+    seconds = max(1.0, min(float(seconds), PROFILE_MAX_SECONDS))
+    profile_state["active"] = True
+    try:
+        await ctx.send(f"Profiling {' '.join(targets) or 'loop'} for {seconds:g}s...")
+        report = await run_profile(seconds, list(targets))
+    finally:
+        profile_state["active"] = False
+    name = f"profile-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.txt"
+    await ctx.send("Profile finished.", file=discord.File(io.BytesIO(report.encode("utf-8")), filename=name))
+
+# ---------------- Metrics endpoint / !stats ----------------
+metrics.gauge("bot_tracker_entries", lambda: [
+    ((("tracker", "spam_tracker"),), len(spam_tracker)),
+    ((("tracker", "spam_strikes"),), len(spam_strikes)),
+    ((("tracker", "recent_logs"),), sum(len(v) for v in recent_logs.values())),
+    ((("tracker", "recent_renames"),), len(recent_renames)),
+    ((("tracker", "guild_policies"),), len(guild_policies)),
+    ((("tracker", "panel_messages"),), len(panel_message_map)),
+    ((("tracker", "journal_records"),), journal.records),
+    ((("tracker", "guild_baselines"),), len(guild_baselines)),
+    ((("tracker", "known_webhooks"),), sum(len(v) for v in known_webhooks.values())),
+    ((("tracker", "threats"),), len(threats)),
+    ((("tracker", "offenses"),), len(offenses)),
+    ((("tracker", "content_clusters"),), sum(len(ix.clusters) for ix in content_indexes.values())),
+], "Entries held in in-memory trackers")
+metrics.gauge("bot_guilds", lambda: [((), len(bot.guilds))])
+metrics.gauge("bot_verify_queue_depth", lambda: [((), verify_queue.qsize())])
+metrics.gauge("bot_shard_latency_seconds", lambda: [
+    ((("shard", sid),), lat) for sid, lat in shard_latencies() if lat == lat and lat != float("inf")
+])
+metrics.gauge("bot_shard_events_per_second", lambda: [
+    ((("shard", sid),), h.rate()) for sid, h in shard_health.items()
+])
+metrics.gauge("bot_rss_megabytes", lambda: [((), current_rss_mb())])
+
+metrics_runner = None
+metrics_task = None
+
+async def metrics_handler(request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server():
+    global metrics_runner
+    if metrics_runner is not None or METRICS_PORT <= 0:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    except OSError as e:
+        print(f"[!] metrics endpoint not started on {METRICS_HOST}:{METRICS_PORT}: {e}")
+        await runner.cleanup()
+        return
+    metrics_runner = runner
+    print(f"Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+def metric_totals(name):
+    # label value -> summed counter value, for single-label counters
+    out = defaultdict(float)
+    for (n, labels), v in metrics.counters.items():
+        if n == name:
+            out[labels[0][1] if labels else ""] += v
+    return out
+
+def stats_report():
+    lines = [lag_report(), overload.report(), sweeper_report(), role_audit_report(), verify_report(), "[events] handler -> count | mean | p95"]
+    for handler, count in sorted(metric_totals("bot_events_total").items(), key=lambda kv: -kv[1]):
+        _, mean, p95 = metrics.histogram_summary("bot_handler_seconds", (("handler", handler),))
+        lines.append(f"  {handler} -> {count:g} | {mean * 1000:.1f}ms | <={p95 * 1000:g}ms")
+    rest = metric_totals("bot_rest_requests_total")
+    limited = metric_totals("bot_rest_429_total")
+    lines.append(f"[rest] requests {sum(rest.values()):g} | 429s {sum(limited.values()):g}")
+    for route, count in sorted(rest.items(), key=lambda kv: -kv[1])[:8]:
+        lines.append(f"  {route} -> {count:g} (429: {limited.get(route, 0):g})")
+    lines.append("[storage] op/doc -> count | mean")
+    for (name, labels), h in sorted(metrics.histograms.items()):
+        if name != "bot_storage_seconds":
+            continue
+        count, mean, _ = metrics.histogram_summary(name, labels)
+        lines.append(f"  {labels[0][1]}/{labels[1][1]} -> {count} | {mean * 1000:.2f}ms")
+    lines.append(
+        f"[threats] {len(threats)} listed | bloom {threat_bloom.size // 8 // 1024}KiB k={threat_bloom.hashes} | "
+        f"joins {threat_stats['joins_checked']} | bloom hits {threat_stats['bloom_hits']} | blocked {threat_stats['blocked']}"
+    )
+    lines.append("[incidents] status -> count")
+    for status, count in sorted(metric_totals("bot_incidents_total").items(), key=lambda kv: -kv[1]):
+        lines.append(f"  {status} -> {count:g}")
+    lines.append("[trackers] " + ", ".join(f"{dict(l)['tracker']}={v:g}" for l, v in metrics.gauges["bot_tracker_entries"]()))
+    return lines
+
+@bot.command(name="stats")
+async def stats(ctx: commands.Context):
+    if ctx.author.id != MASTER_OWNER_ID:
+        return await ctx.send("Only the master owner can view stats.", delete_after=8)
+    text = shell_block(stats_report())
+    if len(text) > 1990:
+        text = shell_block(stats_report()[:40] + ["... (truncated, see /metrics)"])
+    await ctx.send(text[:2000])
+
 # ---------------- Bot ready ----------------
 @bot.event
 async def on_ready():
     print(f"Security Bot ready: {bot.user} (ID {bot.user.id})")
+    if not ready_stats:
+        ready_stats["ready_seconds"] = time.monotonic() - BOOT_TS
+        ready_stats["ready_rss_mb"] = current_rss_mb()
+        print(" | ".join(runtime_report()))
+    if RUN_MODE == "sharded":
+        # per-shard setup already ran in on_shard_ready as each shard came up
+        start_background_tasks()
+        return
+    get_shard_health(0).ready = True
     try:
         await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name="Anti-Raid-Bot"))
     except Exception:
         pass
 
-    g = await find_guild()
-    if g:
-        await ensure_shame_channel(g)
-        await ensure_logs_channel(g)
-    else:
+    if not bot.guilds:
         print("Warning: No guild detected.")
+    await provision_guilds(bot.guilds)
+    await audit_catchup(bot.guilds)
 
+    start_background_tasks()
+
+def start_background_tasks():
+    global metrics_task
+    start_lag_monitor()
+    if not journal.loaded and not journal.loading:
+        threading.Thread(target=journal.load, name="journal-index", daemon=True).start()
+    if metrics_task is None:
+        metrics_task = asyncio.create_task(start_metrics_server())
     if not expire_check.is_running():
         expire_check.start()
     if not panel_updater.is_running():
         panel_updater.start()
+    if not store_sync.is_running():
+        store_sync.start()
+    if not audit_cursor_flush.is_running():
+        audit_cursor_flush.start()
+    if not integrity_sweeper.is_running():
+        integrity_sweeper.start()
+    if not role_permission_audit.is_running():
+        role_permission_audit.start()
+    if not threat_list_sync.is_running():
+        threat_list_sync.start()
+    if not link_filter_refresh.is_running():
+        link_filter_refresh.start()
+    start_verify_workers()
+    if not offense_flush.is_running():
+        offense_flush.start()
+    if not config_watch.is_running():
+        config_watch.start()
+
+# ---------------- Startup provisioning ----------------
+PROVISION_CONCURRENCY = int(os.getenv("PROVISION_CONCURRENCY", "8"))
+provisioned_guilds = set()
+persistent_views_added = False
+
+async def provision_guild(guild: discord.Guild):
+    await ensure_shame_channel(guild)
+    await ensure_logs_channel(guild)
+    await ensure_role(guild, data.get("verify_role_name", "$verified"))
+    await register_guild_webhooks(guild)
+    panel = discord.utils.get(guild.text_channels, name=data.get("panel_channel_name", "security-panel"))
+    if panel:
+        system_channel_ids[(guild.id, panel.name)] = panel.id
+    # whitelisted members are checked on every event; pull them into the member cache
+    if intents.members:
+        missing = [uid for uid in get_whitelist_for_guild(guild.id) if guild.get_member(uid) is None]
+        for i in range(0, len(missing), 100):
+            await guild.query_members(user_ids=missing[i:i + 100], cache=True)
+
+async def provision_guilds(guilds):
+    # bounded-concurrency setup of licensed guilds (plus the home guild);
+    # guilds already done are skipped, so reconnect on_ready calls are cheap
+    global persistent_views_added
+    if not persistent_views_added:
+        bot.add_view(SecurityPanel())
+        bot.add_view(VerifyButton())
+        persistent_views_added = True
+
+    home = int(GUILD_ID) if GUILD_ID else None
+    licensed = licensed_guild_ids()
+    todo = [g for g in guilds if g.id not in provisioned_guilds and (g.id == home or g.id in licensed)]
+    if not todo:
+        return
+    for g in todo:
+        provisioned_guilds.add(g.id)
+    sem = asyncio.Semaphore(max(1, PROVISION_CONCURRENCY))
+    failed = 0
+
+    async def one(g):
+        nonlocal failed
+        async with sem:
+            try:
+                await provision_guild(g)
+            except Exception as e:
+                failed += 1
+                provisioned_guilds.discard(g.id)
+                print(f"[!] provisioning failed for guild {g.id}: {e}")
+
+    start = time.monotonic()
+    await asyncio.gather(*(one(g) for g in todo))
+    elapsed = time.monotonic() - start
+    ready_stats["provision_seconds"] = ready_stats.get("provision_seconds", 0) + elapsed
+    ready_stats["provisioned_guilds"] = len(provisioned_guilds)
+    print(f"Provisioned {len(todo) - failed}/{len(todo)} guilds in {elapsed:.2f}s (concurrency {PROVISION_CONCURRENCY})")
+
+@bot.event
+async def on_shard_ready(shard_id: int):
+    h = get_shard_health(shard_id)
+    h.ready = True
+    h.ready_at = time.monotonic()
+    print(f"Shard {shard_id} ready ({sum(1 for g in bot.guilds if g.shard_id == shard_id)} guilds)")
+    try:
+        await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name="Anti-Raid-Bot"), shard_id=shard_id)
+    except Exception:
+        pass
+    shard_guilds = [g for g in bot.guilds if g.shard_id == shard_id]
+    await provision_guilds(shard_guilds)
+    await audit_catchup(shard_guilds)
+    start_background_tasks()
+
+@bot.event
+async def on_shard_disconnect(shard_id: int):
+    h = get_shard_health(shard_id)
+    h.ready = False
+    h.disconnects += 1
+
+@bot.event
+async def on_shard_resumed(shard_id: int):
+    h = get_shard_health(shard_id)
+    h.ready = True
+    h.resumes += 1
+
+# ---------------- Cluster launcher ----------------
+# RUN_MODE=cluster starts CLUSTER_PROCESSES workers, each running this file in
+# sharded mode over a contiguous range of SHARD_COUNT shards. Workers share
+# state through the sqlite store and are restarted if they exit.
+def cluster_shard_ranges(shard_count: int, processes: int):
+    processes = max(1, min(processes, shard_count))
+    base, extra = divmod(shard_count, processes)
+    ranges, start = [], 0
+    for i in range(processes):
+        n = base + (1 if i < extra else 0)
+        ranges.append(list(range(start, start + n)))
+        start += n
+    return ranges
+
+def run_cluster():
+    processes = int(os.getenv("CLUSTER_PROCESSES", "2"))
+    shard_count = int(os.getenv("SHARD_COUNT", str(processes)))
+    ranges = cluster_shard_ranges(shard_count, processes)
+    script = os.path.abspath(__file__)
+
+    def spawn(i):
+        env = os.environ.copy()
+        env.update({
+            "RUN_MODE": "sharded",
+            "STATE_STORE": "sqlite",
+            "SHARD_COUNT": str(shard_count),
+            "SHARD_IDS": ",".join(str(x) for x in ranges[i]),
+            "CLUSTER_ID": str(i),
+        })
+        print(f"[cluster] starting worker {i} shards {ranges[i][0]}-{ranges[i][-1]}")
+        return subprocess.Popen([sys.executable, script], env=env)
+
+    workers = {i: spawn(i) for i in range(len(ranges))}
+    backoff = defaultdict(lambda: 1.0)
+    try:
+        while True:
+            time.sleep(1)
+            for i, proc in list(workers.items()):
+                code = proc.poll()
+                if code is None:
+                    continue
+                print(f"[!] cluster worker {i} exited with {code}, restarting in {backoff[i]:.0f}s")
+                time.sleep(backoff[i])
+                backoff[i] = min(backoff[i] * 2, 60.0)
+                workers[i] = spawn(i)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in workers.values():
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in workers.values():
+            try:
+                proc.wait(timeout=10)
+            except Exception:
+                proc.kill()
 
 # ---------------- Run ----------------
 if __name__ == "__main__":
+    if RUN_MODE == "cluster":
+        run_cluster()
+        raise SystemExit(0)
     bot.run("MTQzNTkwMzQ4MTUwNzc0MTc4OA.G-ELKX.ajz0WZ-y7hFJ2QnzhAhw4ybzUXvOypgijUDQ5I")
 
  